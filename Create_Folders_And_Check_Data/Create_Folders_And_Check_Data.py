@@ -4,12 +4,26 @@ Main function collects tokens from filenames in given path,
 parses the tokens and writes the parameters to a dictionary.
 '''
 
-import os, argparse, math, re
+import os, argparse, math, re, csv
 import pickle, shutil, datetime
 
-import utils
-import pandas as pd
-from glob import iglob
+import light_utils
+import file_index
+import token_schemes
+import crawler
+import manifest
+import completeness
+import var_dict_store
+import run_stats
+import tiff_check
+import tile_hashes
+import storage_estimate
+import selection_view
+import log_index
+import work_plan
+import numpy as np
+# pandas and utils (OpenCV) are slow to import and only needed on some paths,
+# so they are imported where used
 
 def make_results_folders(input_path, output_path):
 
@@ -30,7 +44,7 @@ def make_results_folders(input_path, output_path):
     output_subdirs = [bg_corrected_path, montaged_path,
         aligned_path, cropped_path, qc_path, results, cell_masks]
 
-    utils.create_folder_hierarchy(output_subdirs, output_path)
+    light_utils.create_folder_hierarchy(output_subdirs, output_path)
 
     var_dict = {'RawImageData': input_path}
     for output_dir_name, output_subdir in zip(
@@ -40,77 +54,89 @@ def make_results_folders(input_path, output_path):
 
     return var_dict
 
-def parse_tokens(filenames, robo_num):
+def check_naming_schemes(var_dict, index, robo_num):
     '''
-    Creates data frame of all files in directory with tokens parsed into separate columns
+    Classify every filename against the naming scheme registry in one pass and
+    return (scheme code per file, name of the scheme of the dataset). Files that do
+    not follow the scheme of most of the dataset are reported together, with
+    the number of files per scheme, rather than failing on the first bad name.
     '''
-    files = pd.DataFrame(filenames, columns = ['Filename'])
-    if robo_num == 0:
-        files[['PID','ExptName','Timepoint','Hours','Well','Panel','Channel','BurstInterval',
-                   'Zstep','Zstep_size']] = files['Filename'].str.split('_', expand = True)
-        print(list(files))
-        files[['Hours','BurstIndex']] = files['Hours'].str.split('-', expand = True)
-        files['Zstep_size'] = files['Zstep_size'].str.replace('.tif', '')
-        files['Timepoint'] = files['Timepoint'].str.replace('T', '')
-        files[['Timepoint','Panel','BurstIndex','Zstep']] = files[['Timepoint','Panel','BurstIndex','Zstep']].astype(int)
-        files.sort_index(level=['Well','Timepoint','Channel','Panel','BurstIndex','Zstep'], inplace = True)
-    elif robo_num == 3:
-        files[['PID','ExptName','Timepoint','Hours','Well','Panel','Channel']] = files['Filename'].str.split('_', expand = True)
-        files['Timepoint'] = files['Timepoint'].str.replace('T', '')
-        files[['Timepoint','Panel']] = files[['Timepoint','Panel']].astype(int)
-        files.sort_index(level=['Well','Timepoint','Panel','Channel'], inplace = True)
-    return files
-
-def get_exp_params_general(var_dict, all_files, morph_channel, robo_num):
+    scheme_codes = token_schemes.classify(index.basenames)
+    scheme, matching = token_schemes.dominant_scheme(scheme_codes, token_schemes.get_schemes(robo_num))
+    if scheme is None or not matching.all():
+        names = token_schemes.scheme_names(scheme_codes)
+        rows = np.flatnonzero(~matching)
+        counts = ', '.join('%s: %d' % (name, count) for name, count in token_schemes.count_schemes(scheme_codes))
+
+        # output to csv
+        with open(os.path.join(var_dict['GalaxyOutputPath'], 'filename-schemes.csv'), 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['Filename', 'Scheme'])
+            writer.writerows((index.path(row), names[row]) for row in rows)
+
+        # throw error if filenames are mixed or malformed
+        if scheme is None:
+            summary = 'No filenames follow a %s naming scheme' % ('known' if robo_num == token_schemes.AUTO_DETECT else 'Robo%d' % robo_num)
+        else:
+            summary = '%d of %d filenames do not follow the %s naming scheme' % (len(rows), len(index), scheme)
+        raise ValueError('%s (also saved as csv in output directory).\nFiles per scheme: %s\n\n%s' % (
+            summary, counts, '\n'.join('%s: %s' % (names[row], index.basenames[row]) for row in rows[:10])))
+    return scheme_codes, scheme
+
+def get_exp_params_general(var_dict, index, morph_channel, robo_num, stats=None):
     '''
     Using filenames in input directory,
     collect experiment parameters (wells, timepoints, channels),
     add them to var_dict.
 
-    Currently supported naming schemes
-    Robo3: PIDdate_ExptName_Timepoint_Hours_Well_MontageNumber_Channel.tif
-    Robo4 epi: PIDdate_ExptName_Timepoint_Hours_Well_MontageNumber_Channel_FilterDet_Camera.tif
-    Robo4 confocal: PIDdate_ExptName_Timepoint_Hours_Well_MontageNumber_FilterDet1_FilterDet2_[FilterDet3]_Channel_DepthIndex_DepthIncrement_Camera.tif
-    Robo0: PIDdate_ExptName_Timepoint_Hours-BurstIndex_Well_MontageNumber_Channel_TimeIncrement_DepthIndex_DepthIncrement.tif
+    The naming schemes are listed in token_schemes; with robo_num 1 the
+    scheme is detected from the filenames.
     '''
-    var_dict['AnalyzedFiles'] = all_files
-    if robo_num == 1:
-        num_tokens = len(os.path.basename(all_files[0]).split('_'))
-        print('Number of tokens:', num_tokens)
-        assert num_tokens == 7 or num_tokens == 10 or num_tokens == 13, 'Auto-detect token standard requires filenames have either 7, 10, or 13 tokens'
-        var_dict['NumberTokens'] = num_tokens
-        if num_tokens == 7:
-            var_dict['RoboNumber'] = 3
-        elif num_tokens == 10:
-            var_dict['RoboNumber'] = 0
-        elif num_tokens == 13:
-            var_dict['RoboNumber'] = 4
-        robo_num = var_dict['RoboNumber']
-    else:
-        var_dict['RoboNumber'] = robo_num
-    print('Token standard: Robo', var_dict['RoboNumber'])
-    var_dict['TimePoints'] = utils.get_timepoints(all_files)
-    var_dict['Wells'] = utils.get_wells(all_files)
-    var_dict['Channels'] = utils.get_channels(
-        all_files, var_dict['RoboNumber'], light_path=var_dict['ImagingMode'])
-    var_dict['MorphologyChannel'] = utils.get_ref_channel(morph_channel, var_dict['Channels'])
+    stats = stats or run_stats.RunStats()
+    with stats.stage('scheme_detection') as counters:
+        scheme_codes, scheme = check_naming_schemes(var_dict, index, robo_num)
+        counters['Files'] = len(index)
+    # the most common variant of the scheme (e.g. Robo4 confocal names with two or three filters)
+    code = int(np.bincount(scheme_codes).argmax())
+    name, var_dict['RoboNumber'], light_path, fields = token_schemes.SCHEMES[code]
+    assert var_dict['RoboNumber'] is not None, 'Filenames follow the %s naming scheme, which this tool cannot process' % name
+    if robo_num == token_schemes.AUTO_DETECT:
+        var_dict['NumberTokens'] = len(fields)
+        print('Number of tokens:', var_dict['NumberTokens'])
+    print('Token standard: Robo', var_dict['RoboNumber'], '(%s)' % name)
+    if var_dict['RoboNumber'] == 4 and var_dict['ImagingMode'] != light_path:
+        print('Filenames are %s names; imaging mode set to %s' % (name, light_path))
+        var_dict['ImagingMode'] = light_path
+    index.set_layout(scheme_codes)
+    var_dict['ExperimentName'] = file_index.get_experiment_name(index)
+    # time each getter separately
+    with stats.stage('get_timepoints'):
+        var_dict['TimePoints'] = file_index.get_timepoints(index)
+    with stats.stage('get_wells'):
+        var_dict['Wells'] = file_index.get_wells(index)
+    with stats.stage('get_channels'):
+        var_dict['Channels'] = file_index.get_channels(index)
+    var_dict['MorphologyChannel'] = light_utils.get_ref_channel(morph_channel, var_dict['Channels'])
     print('Morphology channel: %s' % var_dict['MorphologyChannel'])
-    var_dict['PlateID'] = utils.get_plate_id(all_files)
-    var_dict['Bursts'] = utils.get_burst_iter(all_files)
-    var_dict['BurstIDs'] = utils.get_bursts(all_files)
-    var_dict['Depths'] = utils.get_depths(all_files, var_dict['RoboNumber'])
+    with stats.stage('get_plate_id'):
+        var_dict['PlateID'] = file_index.get_plate_id(index)
+    with stats.stage('get_bursts'):
+        var_dict['Bursts'] = file_index.get_burst_iter(index)
+        var_dict['BurstIDs'] = file_index.get_bursts(index)
+    with stats.stage('get_depths'):
+        var_dict['Depths'] = file_index.get_depths(index)
     if 'ZMAX' not in var_dict['Depths'] and 'ZAVG' not in var_dict['Depths']:
         var_dict['Depths'] = [int(zdepth) for zdepth in var_dict['Depths']]
     var_dict['Resolution'] = -1 #0 is 8-bit, -1 is 16-bit
 
     return var_dict
 
-def get_array_dimensions(all_files, num_cols, num_rows, var_dict):
+def get_array_dimensions(index, num_cols, num_rows, var_dict):
     if num_cols is not None and num_rows is not None:
         var_dict['NumberVerticalImages'] = num_cols
         var_dict['NumberHorizontalImages'] = num_rows
     else:
-        array_size = max([int(os.path.basename(x).split('_')[5]) for x in all_files])
+        array_size = file_index.get_max_panel(index)
         assert is_perfect_square(array_size), 'Array size is not square. Must enter the array dimensions.'
         var_dict['NumberHorizontalImages'] = int(math.sqrt(array_size))
         var_dict['NumberVerticalImages'] = int(math.sqrt(array_size))
@@ -125,137 +151,140 @@ def get_filenames(files_path):
     '''
     Returns list of all tiff (non-fiducial) filenames in a directory as basenames.
     '''
+    import utils
     filenames_full = utils.get_all_files(files_path)
     filenames_basenames = [os.path.basename(x) for x in filenames_full]
 
     return filenames_basenames
 
-def check_data(var_dict):
-    # parse filenames into dataframe and include only user-selected Wells and Timepoints
-    files_df = parse_tokens([os.path.basename(x) for x in var_dict['AnalyzedFiles']], var_dict['RoboNumber'])
-    timepoints = set([int(x.replace('T','')) for x in var_dict['TimePoints']])
-    files_df = files_df[files_df['Well'].isin(var_dict['Wells']) & files_df['Timepoint'].isin(timepoints)]
-    files_df['Channel'] = files_df['Channel'].str.replace('.tif', '')
-
-    # get list of wells with missing panels, timepoints, and/or channels
-    incomplete_wells = []
-    extra_wells = []
-
-    num_panels = var_dict['NumberHorizontalImages'] * var_dict['NumberVerticalImages']
-    panel_counts = files_df.groupby(['Well','Timepoint','Channel']).size().reset_index(name='NumberOfPanels')
-    incomplete_wells.extend(panel_counts.loc[panel_counts['NumberOfPanels'] < num_panels, 'Well'].tolist())
-    extra_wells.extend(panel_counts.loc[panel_counts['NumberOfPanels'] > num_panels, 'Well'].tolist())
-
-    num_timepoints = len(var_dict['TimePoints'])
-    timepoint_counts = files_df.drop_duplicates(subset=['Well','Channel','Timepoint']) \
-        .groupby(['Well','Channel']).size().reset_index(name='NumberOfTimepoints')
-    incomplete_wells.extend(timepoint_counts.loc[timepoint_counts['NumberOfTimepoints'] < num_timepoints, 'Well'].tolist())
-    extra_wells.extend(timepoint_counts.loc[timepoint_counts['NumberOfTimepoints'] > num_timepoints, 'Well'].tolist())
-
-    num_channels = len(var_dict['Channels'])
-    channel_counts = files_df.groupby(['Well','Timepoint','Panel']).size().reset_index(name='NumberOfChannels')
-    incomplete_wells.extend(channel_counts.loc[channel_counts['NumberOfChannels'] < num_channels, 'Well'].tolist())
-    extra_wells.extend(channel_counts.loc[channel_counts['NumberOfChannels'] > num_channels, 'Well'].tolist())
-
-    if len(incomplete_wells) != 0:
-        # filter dataframe by wells with incomplete data
-        incomplete_data = files_df[files_df['Well'].isin(set(incomplete_wells))]
-
-        # create duplicate dataframe for holding panel lists
-        incomplete_data_output = incomplete_data[['Well', 'Channel']].drop_duplicates()
-
-        for tp in timepoints:
-
-            # subset data by current timepoint, create a column with list of existing panels
-            incomplete_data_tp = incomplete_data.loc[incomplete_data['Timepoint'] == tp] \
-                .groupby(['Well', 'Channel'])['Panel'] \
-                .apply(list) \
-                .reset_index(name = 'T' + str(tp) + '_tiles')
-
-            # create a column for list of missing panels and convert list to comma-separated string
-            incomplete_data_tp['T' + str(tp) + '_missing-tiles'] = incomplete_data_tp['T' + str(tp) + '_tiles'] \
-                .apply(lambda x: [str(i) for i in range(1, num_panels+1) if i not in x]) \
-                .apply(','.join)
-
-            # remove column with list of existing panels
-            incomplete_data_tp.drop(['T' + str(tp) + '_tiles'], axis = 1, inplace = True)
-
-            # if dataframe is not empty
-            if len(incomplete_data_tp) != 0:
-                # merge timepoint dataframe with bywell dataframe
-                incomplete_data_output = pd.merge(incomplete_data_output, incomplete_data_tp, on = ['Well', 'Channel'], how = 'left')
-
-                # convert NaNs (well/channel/timepoints missing all panels) to a list of all panels
-                incomplete_data_output.iloc[:,-1].fillna(','.join([str(i) for i in range(1, num_panels + 1)]), inplace = True)
-
-            # else if dataframe is empty (i.e. all wells/channels at the current timepoint are missing all panels)
+def hash_extra_tiles(var_dict, index, occupancy, extra_wells, workers=tile_hashes.DEFAULT_WORKERS):
+    '''
+    Content-hash the files of every duplicated tile and group them into identical sets,
+    saved as <ExperimentName>_extra-tile-hashes.csv. The first file of each set is kept;
+    the other, byte-identical copies are listed in <ExperimentName>_duplicate-copies.csv
+    and their index rows returned. Tiles left with differing files were re-acquired.
+    '''
+    cells = occupancy.duplicate_cells(extra_wells)
+    paths = [index.path(row) for cell, cell_rows in cells for row in cell_rows]
+    hashes = tile_hashes.hash_files(paths, workers)
+    set_numbers = tile_hashes.identical_sets(hashes)
+
+    hash_table = []
+    copies = []
+    copy_rows = []
+    num_reacquired = 0
+    i = 0
+    for (w, t, c, p), cell_rows in cells:
+        kept = {}
+        actions = []
+        for j, row in enumerate(cell_rows, i):
+            if set_numbers[j] in kept:
+                actions.append('drop')
+                copies.append((paths[j], paths[kept[set_numbers[j]]]))
+                copy_rows.append(row)
             else:
-                incomplete_data_output['T' + str(tp) + '_missing-tiles'] = ','.join([str(i) for i in range(1, num_panels + 1)])
+                kept[set_numbers[j]] = j
+                actions.append('keep')
+        if len(kept) > 1:
+            # differing files for one tile need a decision
+            actions = ['re-acquired' if action == 'keep' else action for action in actions]
+            num_reacquired += 1
+        for j, action in enumerate(actions, i):
+            size, digest, hashed_from = hashes[j]
+            hash_table.append([occupancy.wells[w], 'T%d' % occupancy.timepoints[t], occupancy.channels[c],
+                int(occupancy.panels[p]), paths[j], size, digest, hashed_from, set_numbers[j], action])
+        i += len(cell_rows)
+
+    # output to csv
+    with open(os.path.join(var_dict['GalaxyOutputPath'], var_dict['ExperimentName'] + '_extra-tile-hashes.csv'), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Well', 'Timepoint', 'Channel', 'Panel', 'Filename', 'Bytes', 'Hash', 'HashedFrom', 'IdenticalSet', 'Action'])
+        writer.writerows(hash_table)
+    with open(os.path.join(var_dict['GalaxyOutputPath'], var_dict['ExperimentName'] + '_duplicate-copies.csv'), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Filename', 'IdenticalTo'])
+        writer.writerows(copies)
+    print('Hashed %d files of %d duplicated tiles: dropped %d identical copies, %d tiles re-acquired' % (
+        len(paths), len(cells), len(copies), num_reacquired))
+    return np.array(copy_rows, dtype=np.int64)
+
+def check_data(var_dict, index, mask, hash_workers=0):
+    '''
+    Check the selected files for wells with missing or extra tiles.
+    With hash_workers, duplicated tiles are content-hashed first and byte-identical
+    copies are dropped from the selection (and AnalyzedFiles). Returns the selection mask.
+    '''
+    # count selected files into a Well x Timepoint x Channel x Panel occupancy tensor
+    num_panels = var_dict['NumberHorizontalImages'] * var_dict['NumberVerticalImages']
+    # timepoint tokens as they appear in the filenames (e.g. T01), in numeric order
+    timepoints = sorted(var_dict['TimePoints'], key=file_index.token_sort_key)
+    occupancy = completeness.Occupancy(index, mask, var_dict['Wells'], timepoints, var_dict['Channels'], num_panels)
+
+    # get wells with missing or extra panels, timepoints, and/or channels
+    incomplete_wells, extra_wells = occupancy.problem_wells()
+
+    # drop identical copies of duplicated tiles and check again
+    if extra_wells.any() and hash_workers:
+        copies = hash_extra_tiles(var_dict, index, occupancy, extra_wells, hash_workers)
+        if len(copies) > 0:
+            mask = mask.copy()
+            mask[copies] = False
+            var_dict['AnalyzedFiles'] = index.paths(mask)
+            occupancy = completeness.Occupancy(index, mask, var_dict['Wells'], timepoints, var_dict['Channels'], num_panels)
+            incomplete_wells, extra_wells = occupancy.problem_wells()
+    timepoints = occupancy.timepoints
+
+    if incomplete_wells.any() or extra_wells.any():
+        import pandas as pd
+
+    if incomplete_wells.any():
+        incomplete_data_output = pd.DataFrame(occupancy.missing_tiles(incomplete_wells),
+            columns = ['Well', 'Channel'] + ['T' + str(tp) + '_missing-tiles' for tp in timepoints])
 
         # output to csv
         incomplete_data_output.to_csv(os.path.join(var_dict['GalaxyOutputPath'], var_dict['ExperimentName'] + '_missing-images.csv'), index = False)
 
         # throw error if missing images
-        if len(incomplete_wells) != 0:
-            raise ValueError('Dataset is missing images (also saved as csv in output directory):\n\n%s' % incomplete_data_output.to_string(index = False, index_names = False))
-
-    if len(extra_wells) != 0:
-        # filter dataframe by wells with extra data
-        extra_data = files_df[files_df['Well'].isin(set(extra_wells))]
-
-        # create duplicate dataframe for holding panel lists
-        extra_data_output = extra_data[['Well', 'Channel']].drop_duplicates()
-
-        for tp in timepoints:
+        raise ValueError('Dataset is missing images (also saved as csv in output directory):\n\n%s' % incomplete_data_output.to_string(index = False, index_names = False))
 
-            # subset data by current timepoint, create a column with list of existing panels
-            extra_data_tp = extra_data.loc[extra_data['Timepoint'] == tp] \
-                .groupby(['Well', 'Channel'])['Panel'] \
-                .apply(list) \
-                .reset_index(name = 'T' + str(tp) + '_tiles')
+    if extra_wells.any():
+        extra_data_output = pd.DataFrame(occupancy.extra_tiles(extra_wells),
+            columns = ['Well', 'Channel'] + ['T' + str(tp) + '_extra-tiles' for tp in timepoints])
 
-            def count_duplicates(lst):
-                #count duplicated tiles
-                duplicates_dict = {}
-                for x in lst:
-                    if lst.count(x) > 1:
-                        if x not in duplicates_dict:
-                            duplicates_dict[x] = lst.count(x)
-                return duplicates_dict
-
-            extra_data_tp['T' + str(tp) + '_extra-tiles'] = extra_data_tp['T' + str(tp) + '_tiles'].apply(count_duplicates)
-
-            # remove column with list of existing panels
-            extra_data_tp.drop(['T' + str(tp) + '_tiles'], axis = 1, inplace = True)
-
-            # if dataframe is not empty
-            if len(extra_data_tp) != 0:
-                # merge timepoint dataframe with bywell dataframe
-                extra_data_output = pd.merge(extra_data_output, extra_data_tp, on = ['Well', 'Channel'], how = 'left')
+        # output to csv
+        extra_data_output.to_csv(os.path.join(var_dict['GalaxyOutputPath'], var_dict['ExperimentName'] + '_extra-images.csv'), index = False)
 
-                # convert NaNs (well/channel/timepoints missing all panels) to a list of all panels
-                extra_data_output.iloc[:,-1].fillna(','.join([str(i) for i in range(1, num_panels + 1)]), inplace = True)
+        # throw error if extra images
+        raise ValueError('Dataset has extra tiles (also saved as csv in output directory):\n\n%s' % extra_data_output.to_string(index = False, index_names = False))
 
-            # else if dataframe is empty (i.e. all wells/channels at the current timepoint are missing all panels)
-            else:
-                extra_data_output['T' + str(tp) + '_extra-tiles'] = ','.join([str(i) for i in range(1, num_panels + 1)])
+    return mask
 
+def check_image_headers(var_dict, workers=tiff_check.DEFAULT_WORKERS):
+    '''
+    Read the TIFF header of every analyzed file (no pixel decoding) and flag
+    zero-byte, truncated, wrongly sized or wrong bit depth images.
+    '''
+    bits_per_sample = 16 if var_dict['Resolution'] == -1 else 8
+    problems = tiff_check.check_tiff_headers(var_dict['AnalyzedFiles'], bits_per_sample, workers)
+    if len(problems) != 0:
         # output to csv
-        extra_data_output.to_csv(os.path.join(var_dict['GalaxyOutputPath'], var_dict['ExperimentName'] + '_extra-images.csv'), index = False)
+        with open(os.path.join(var_dict['GalaxyOutputPath'], var_dict['ExperimentName'] + '_corrupt-images.csv'), 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['Filename', 'Problem'])
+            writer.writerows(problems)
 
-        # throw error if missing images
-        if len(extra_wells) != 0:
-            raise ValueError('Dataset has extra tiles (also saved as csv in output directory):\n\n%s' % extra_data_output.to_string(index = False, index_names = False))
+        # throw error if corrupt images
+        raise ValueError('Dataset has unreadable or corrupt images (also saved as csv in output directory):\n\n%s' %
+            '\n'.join('%s: %s' % (os.path.basename(path), problem) for path, problem in problems))
 
 def get_timepoint_hours(selected_timepoints, input_path, output_path):
     '''Looks for log files in input path, parses the dates/times of the first image, and saves a csv with the timepoint-hours conversion'''
     first_lines = []
-    log_paths = [x for x in iglob(os.path.join(input_path, '*.log')) if 'ImageStart' not in os.path.basename(x)]
-    if len(log_paths) > 0:
-        # sort log files by timepoint
-        log_paths.sort(key=lambda x:int(re.findall(r'(?<=-T)\d{1,2}(?=\.log)', x)[0]))
-        # get list of timepoints
-        log_timepoints = [re.findall(r'(?<=-T)\d{1,2}(?=\.log)', x)[0] for x in log_paths]
+    # log files sorted by timepoint
+    timepoint_logs = crawler.get_timepoint_logs(input_path)
+    if len(timepoint_logs) > 0:
+        log_timepoints = [tp for tp, log in timepoint_logs]
+        log_paths = [log for tp, log in timepoint_logs]
         # read in first acquired image of each timepoint
         for log in log_paths:
             with open(log, 'r') as l:
@@ -281,11 +310,39 @@ def get_timepoint_hours(selected_timepoints, input_path, output_path):
 
         return [elapsed_hours[i] for i in selected_timepoints_idx]
 
+def get_well_hours(var_dict, index, mask, input_path, output_path, workers=log_index.DEFAULT_WORKERS):
+    '''
+    Index every log file in input path (including ImageStart logs), save the acquisition
+    time of each selected image and the start of each well at each timepoint as csvs,
+    and return the elapsed hours per well for the selected timepoints.
+    '''
+    log_paths = log_index.get_log_files(input_path)
+    if len(log_paths) == 0:
+        print('No log files to index in', input_path)
+        return None
+    logs = log_index.LogIndex.from_logs(log_paths, workers)
+    times = logs.times(index, mask)
+    print('Indexed %d logged images from %d log files; %d of %d selected images logged' % (
+        len(logs), len(log_paths), (times >= 0).sum(), len(times)))
+    log_index.write_image_times(os.path.join(output_path, 'image_times.csv'), index, mask, times)
+
+    wells, timepoints = var_dict['Wells'], var_dict['TimePoints']
+    elapsed, starts, first_rows = log_index.well_hours(index, mask, times, wells, timepoints, logs.start())
+    with open(os.path.join(output_path, 'well_hours.csv'), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Well', 'Timepoint', 'ElapsedHours', 'StartDate', 'StartTime', 'FirstImage'])
+        for w, well in enumerate(wells):
+            for t, tp in enumerate(timepoints):
+                if first_rows[w, t] >= 0:
+                    start = log_index.to_datetime(starts[w, t])
+                    writer.writerow([well, tp.replace('T', ''), elapsed[w, t], start.strftime('%y-%m-%d'),
+                        start.strftime('%H:%M:%S'), index.basenames[first_rows[w, t]]])
+    return dict((well, [None if np.isnan(x) else float(x) for x in elapsed[w]]) for w, well in enumerate(wells))
+
+
+def get_parser():
+    '''Argument parser of the tool (also read by batch mode for the argument names and kinds).'''
 
-def main():
-    '''Point of entry.'''
-
-    # Argument parsing
     parser = argparse.ArgumentParser(description="Process cell data.")
     parser.add_argument("input_path",
         help="Folder path to input data.")
@@ -313,7 +370,8 @@ def main():
     parser.add_argument("--num_rows", dest="num_rows", type=int,
         help="Number of vertical images in montage.")
     parser.add_argument("check_data_option",
-        help="Chose whether to check for wells with incomplete data.")
+        type=int, choices=[0, 1, 2],
+        help="Chose whether to check for wells with incomplete data (0: no, 1: filenames, 2: filenames and TIFF headers).")
     parser.add_argument("outfile",
         help="Name of output dictionary.")
     parser.add_argument("--min_cell",
@@ -334,112 +392,243 @@ def main():
     parser.add_argument("--chosen_channels", "-cc",
         dest = "chosen_channels", default = '',
         help="Specify channels to include or exclude.")
-    args = parser.parse_args()
-
-    # Set up I/O parameters
-    input_path = str.strip(args.input_path)
-    output_path = str.strip(args.output_path)
-    dir_structure = args.dir_structure
-    robo_num = args.robo_num
-    morph_channel = str.strip(args.morph_channel)
-    check_data_option = int(args.check_data_option)
-    outfile = args.outfile
-
-    # Confirm given folders exist
-    assert os.path.exists(input_path), 'Confirm that the input folder (%s) exists.' % input_path
-    assert 'GXYTMP' in output_path, 'Output folder must contain the string "GXYTMP" (case sensitive)'
-    assert os.path.exists(os.path.split(output_path)[0]), 'Confirm that the output path parent folder (%s) exists.' % os.path.split(output_path)[0]
-    assert re.match('^[a-zA-Z0-9_-]+$', os.path.split(output_path)[1]), 'Confirm that the output folder name (%s) does not contain special characters.' % os.path.split(output_path)[1]
-    assert '/gladstone/finkbeiner/' in output_path, 'Output folder must be in the new server'
+    parser.add_argument("--crawl_workers",
+        dest="crawl_workers", type=int, default=crawler.DEFAULT_WORKERS,
+        help="Number of well folders listed concurrently when crawling the input folder.")
+    parser.add_argument("--cache_dir",
+        dest="cache_dir", default='',
+        help="Folder for the crawl manifest reused by later runs (defaults to the output folder).")
+    parser.add_argument("--rescan",
+        dest="rescan", action="store_true",
+        help="Ignore the crawl manifest and list every folder again.")
+    parser.add_argument("--outfile_format",
+        dest="outfile_format", choices=['pickle', 'compact'], default='pickle',
+        help="Format of the output dictionary: pickle, or compact (memory-mappable file table, read with var_dict_store.load_var_dict).")
+    parser.add_argument("--header_check_workers",
+        dest="header_check_workers", type=int, default=tiff_check.DEFAULT_WORKERS,
+        help="Number of files whose TIFF headers are read concurrently when check_data_option is 2.")
+    parser.add_argument("--hash_extra_tiles",
+        dest="hash_extra_tiles", action="store_true",
+        help="Content-hash duplicated tiles; byte-identical copies are dropped instead of failing the check.")
+    parser.add_argument("--hash_workers",
+        dest="hash_workers", type=int, default=tile_hashes.DEFAULT_WORKERS,
+        help="Number of files hashed concurrently with --hash_extra_tiles.")
+    parser.add_argument("--disk_check",
+        dest="disk_check", choices=storage_estimate.DISK_CHECK, default='warn',
+        help="Whether to fail, warn or do nothing when the estimated output does not fit in the free space at the output path.")
+    parser.add_argument("--selection_view",
+        dest="selection_view", choices=['none'] + selection_view.VIEW_BY, default='none',
+        help="Link the selected images into SelectedImages/<well>[/<timepoint>] in the output folder and point var_dict at it.")
+    parser.add_argument("--view_workers",
+        dest="view_workers", type=int, default=selection_view.DEFAULT_WORKERS,
+        help="Number of links created or removed concurrently for --selection_view.")
+    parser.add_argument("--index_logs",
+        dest="index_logs", action="store_true",
+        help="Index every log line for per-image acquisition times and per-well elapsed hours (image_times.csv, well_hours.csv).")
+    parser.add_argument("--log_workers",
+        dest="log_workers", type=int, default=log_index.DEFAULT_WORKERS,
+        help="Number of log files read concurrently with --index_logs.")
+    parser.add_argument("--work_plan",
+        dest="work_plan", default='',
+        help="Optional path of a JSON work plan splitting the selected files into shards for downstream steps.")
+    parser.add_argument("--shard_by",
+        dest="shard_by", choices=work_plan.SHARD_BY, default='well',
+        help="Shard unit of the work plan: whole wells, or well x timepoint.")
+    parser.add_argument("--shard_files",
+        dest="shard_files", type=int, default=0,
+        help="Target number of files per shard (0 for one unit per shard).")
+    parser.add_argument("--shard_bytes",
+        dest="shard_bytes", type=int, default=0,
+        help="Target number of bytes per shard; overrides --shard_files.")
+    return parser
+
+
+def main(argv=None):
+    '''Point of entry. argv defaults to the command line; returns var_dict.'''
+
+    args = get_parser().parse_args(argv)
+    stats = run_stats.RunStats()
+    # the stats sidecar is written for every run that gets as far as creating the output folder
+    stats_path = None
+    sidecar = {'Status': 'ok'}
+    try:
+        # Set up I/O parameters
+        input_path = str.strip(args.input_path)
+        output_path = str.strip(args.output_path)
+        dir_structure = args.dir_structure
+        robo_num = args.robo_num
+        morph_channel = str.strip(args.morph_channel)
+        check_data_option = args.check_data_option
+        outfile = args.outfile
+
+        # Confirm given folders exist
+        assert os.path.exists(input_path), 'Confirm that the input folder (%s) exists.' % input_path
+        assert 'GXYTMP' in output_path, 'Output folder must contain the string "GXYTMP" (case sensitive)'
+        assert os.path.exists(os.path.split(output_path)[0]), 'Confirm that the output path parent folder (%s) exists.' % os.path.split(output_path)[0]
+        assert re.match('^[a-zA-Z0-9_-]+$', os.path.split(output_path)[1]), 'Confirm that the output folder name (%s) does not contain special characters.' % os.path.split(output_path)[1]
+        assert '/gladstone/finkbeiner/' in output_path, 'Output folder must be in the new server'
     
-    # Confirm that morphology channel is given
-    assert morph_channel != '', 'Confirm that you have provided a morphology channel.'
-
-    # Set up dictionary parameters
-    utils.create_dir(output_path)
-    var_dict = make_results_folders(input_path, output_path)
-    var_dict['ImagingMode'] = args.imaging_mode
-    var_dict['IntensityThreshold'] = args.threshold_percent
-    var_dict['DirStructure'] = dir_structure
-    var_dict['ImagePixelOverlap'] = args.pixel_overlap
-    var_dict['InputPath'] = input_path
-    var_dict['GalaxyOutputPath'] = output_path
-    all_files = utils.get_all_files_all_subdir(input_path)
-    assert len(all_files) > 0, 'No files to process.'
-    var_dict['ExperimentName'] = os.path.basename(all_files[0]).split('_')[1]
-    var_dict = get_exp_params_general(var_dict, all_files, morph_channel, robo_num)
-
-    get_array_dimensions(all_files, args.num_cols, args.num_rows, var_dict)
-
-    start_time = datetime.datetime.utcnow()
-
-    # Handle processing specified wells
-    user_chosen_wells = args.chosen_wells.strip()
-    if user_chosen_wells != '':
-        user_chosen_wells = utils.get_iter_from_user(user_chosen_wells, 'wells')
-        print('Initial wells:', var_dict['Wells'])
-        if args.wells_toggle == 'exclude':
-            var_dict['Wells'] = [x for x in var_dict['Wells']  if x not in user_chosen_wells]
-        elif args.wells_toggle == 'include':
-            assert set(user_chosen_wells).issubset(set(var_dict['Wells'])), 'Confirm that the selected wells (%s) exist in the dataset' % user_chosen_wells
-            var_dict['Wells'] = user_chosen_wells
-    print('Selected Wells:', var_dict['Wells'])
-
-    # Handle processing specified timepoints
-    user_chosen_timepoints = args.chosen_timepoints.strip()
-    if user_chosen_timepoints != '':
-        user_chosen_timepoints = utils.get_iter_from_user(user_chosen_timepoints, 'timepoints')
-        print('Initial timepoints', var_dict['TimePoints'])
-        if args.timepoints_toggle == 'exclude':
-            var_dict['TimePoints'] = [x for x in var_dict['TimePoints'] if x not in user_chosen_timepoints]
-        elif args.timepoints_toggle == 'include':
-            assert set(user_chosen_timepoints).issubset(set(var_dict['TimePoints'])), 'Confirm that the selected timepoints (%s) exist within the dataset' % user_chosen_timepoints
-            var_dict['TimePoints'] = user_chosen_timepoints
-    print('Selected timepoints:', var_dict['TimePoints'])
-
-    # parse first line of log files, output timepoint-hours csv, save to dictionary
-    var_dict['ElapsedHours'] = get_timepoint_hours(var_dict['TimePoints'], input_path, output_path)
-    print('Elapsed hours for selected timepoints:', var_dict['ElapsedHours'])
-
-    # Handle processing specified channels
-    user_chosen_channels = args.chosen_channels.strip()
-    if user_chosen_channels != '':
-        print('Initial channels', var_dict['Channels'])
-        user_chosen_channels = [utils.get_ref_channel(x, var_dict['Channels']) for x in user_chosen_channels.split(',')]
-        if args.channels_toggle == 'exclude':
-            var_dict['Channels'] = [x for x in var_dict['Channels'] if x not in user_chosen_channels]
-        elif args.channels_toggle == 'include':
-            assert set(user_chosen_channels).issubset(set(var_dict['Channels'])), 'Confirm that the selected channels (%s) exist within the dataset' % user_chosen_channels
-            var_dict['Channels'] = user_chosen_channels
-    assert var_dict['MorphologyChannel'] in var_dict['Channels'], 'The morphology channel (%s) not found within the selected channels (%s)' % (var_dict['MorphologyChannel'], ', '.join(var_dict['Channels']))
-    print('Selected channels:', var_dict['Channels'])
-
-    # update AnalyzedFiles to include only files for user-selected Wells, Timepoints, Channels
-    var_dict['AnalyzedFiles'] = [x for x in var_dict['AnalyzedFiles'] if os.path.basename(x).split('_')[4] in var_dict['Wells']]
-    var_dict['AnalyzedFiles'] = [x for x in var_dict['AnalyzedFiles'] if os.path.basename(x).split('_')[2] in var_dict['TimePoints']]
-    ch_token_pos = utils.get_channel_token(var_dict['RoboNumber'])
-    var_dict['AnalyzedFiles'] = [x for x in var_dict['AnalyzedFiles'] if
-             os.path.basename(x).split('_')[ch_token_pos].replace('.tif','') in
-             var_dict['Channels']]
-    assert len(var_dict['AnalyzedFiles']) > 0, 'No image files match the selected include/exclude criteria'
-
-    # check filenames for wells with missing timepoints, panels, or channels
-    if check_data_option == 1:
-        check_data(var_dict)
-
-    # ----Output for user and save dict----------
-    print('Input path:', input_path)
-    print('Input directory structure:', dir_structure)
-    print('Results output path:', output_path)
-
-    pickle.dump(var_dict, open('var_dict.p', 'wb'))
-    # outfile = os.rename('var_dict.p', outfile)
-    outfile = shutil.move('var_dict.p', outfile)
-    timestamp = utils.update_timestring()
-    utils.save_user_args_to_csv(args, output_path, 'create_folders'+'_'+timestamp)
-
-    end_time = datetime.datetime.utcnow()
-    print('Module run time:', end_time - start_time)
+        # Confirm that morphology channel is given
+        assert morph_channel != '', 'Confirm that you have provided a morphology channel.'
+
+        # Set up dictionary parameters
+        timestamp = light_utils.update_timestring()
+        light_utils.create_dir(output_path)
+        stats_path = os.path.join(output_path, 'create_folders_' + timestamp + '_stats.json')
+        with stats.stage('make_folders'):
+            var_dict = make_results_folders(input_path, output_path)
+        var_dict['ImagingMode'] = args.imaging_mode
+        var_dict['IntensityThreshold'] = args.threshold_percent
+        var_dict['DirStructure'] = dir_structure
+        var_dict['ImagePixelOverlap'] = args.pixel_overlap
+        var_dict['InputPath'] = input_path
+        var_dict['GalaxyOutputPath'] = output_path
+        # tokenize every filename once; all getters and filters read from this index
+        cache_dir = args.cache_dir.strip() or output_path
+        light_utils.create_dir(cache_dir)
+        index = manifest.crawl_cached(input_path, dir_structure, robo_num, cache_dir,
+            rescan=args.rescan, workers=args.crawl_workers, stats=stats)
+        sidecar['Files'] = len(index)
+        assert len(index) > 0, 'No files to process.'
+        var_dict = get_exp_params_general(var_dict, index, morph_channel, robo_num, stats=stats)
+
+        with stats.stage('array_dimensions'):
+            get_array_dimensions(index, args.num_cols, args.num_rows, var_dict)
+
+        # Handle processing specified wells
+        user_chosen_wells = args.chosen_wells.strip()
+        if user_chosen_wells != '':
+            user_chosen_wells = light_utils.get_iter_from_user(user_chosen_wells, 'wells')
+            print('Initial wells:', var_dict['Wells'])
+            if args.wells_toggle == 'exclude':
+                var_dict['Wells'] = [x for x in var_dict['Wells']  if x not in user_chosen_wells]
+            elif args.wells_toggle == 'include':
+                assert set(user_chosen_wells).issubset(set(var_dict['Wells'])), 'Confirm that the selected wells (%s) exist in the dataset' % user_chosen_wells
+                var_dict['Wells'] = user_chosen_wells
+        print('Selected Wells:', var_dict['Wells'])
+
+        # Handle processing specified timepoints
+        user_chosen_timepoints = args.chosen_timepoints.strip()
+        if user_chosen_timepoints != '':
+            user_chosen_timepoints = light_utils.get_iter_from_user(user_chosen_timepoints, 'timepoints')
+            print('Initial timepoints', var_dict['TimePoints'])
+            if args.timepoints_toggle == 'exclude':
+                var_dict['TimePoints'] = [x for x in var_dict['TimePoints'] if x not in user_chosen_timepoints]
+            elif args.timepoints_toggle == 'include':
+                assert set(user_chosen_timepoints).issubset(set(var_dict['TimePoints'])), 'Confirm that the selected timepoints (%s) exist within the dataset' % user_chosen_timepoints
+                var_dict['TimePoints'] = user_chosen_timepoints
+        print('Selected timepoints:', var_dict['TimePoints'])
+
+        # parse first line of log files, output timepoint-hours csv, save to dictionary
+        with stats.stage('log_parsing'):
+            var_dict['ElapsedHours'] = get_timepoint_hours(var_dict['TimePoints'], input_path, output_path)
+        print('Elapsed hours for selected timepoints:', var_dict['ElapsedHours'])
+
+        # Handle processing specified channels
+        user_chosen_channels = args.chosen_channels.strip()
+        if user_chosen_channels != '':
+            print('Initial channels', var_dict['Channels'])
+            user_chosen_channels = [light_utils.get_ref_channel(x, var_dict['Channels']) for x in user_chosen_channels.split(',')]
+            if args.channels_toggle == 'exclude':
+                var_dict['Channels'] = [x for x in var_dict['Channels'] if x not in user_chosen_channels]
+            elif args.channels_toggle == 'include':
+                assert set(user_chosen_channels).issubset(set(var_dict['Channels'])), 'Confirm that the selected channels (%s) exist within the dataset' % user_chosen_channels
+                var_dict['Channels'] = user_chosen_channels
+        assert var_dict['MorphologyChannel'] in var_dict['Channels'], 'The morphology channel (%s) not found within the selected channels (%s)' % (var_dict['MorphologyChannel'], ', '.join(var_dict['Channels']))
+        print('Selected channels:', var_dict['Channels'])
+
+        # update AnalyzedFiles to include only files for user-selected Wells, Timepoints, Channels
+        with stats.stage('filtering') as counters:
+            selected = index.select(Well=var_dict['Wells'], Timepoint=var_dict['TimePoints'], Channel=var_dict['Channels'])
+            var_dict['AnalyzedFiles'] = index.paths(selected)
+            counters['FilesSeen'] = len(index)
+            counters['FilesSelected'] = len(var_dict['AnalyzedFiles'])
+        assert len(var_dict['AnalyzedFiles']) > 0, 'No image files match the selected include/exclude criteria'
+
+        # project the output footprint of the downstream steps and compare it with the free space
+        with stats.stage('storage_estimate') as counters:
+            estimate = storage_estimate.estimate_output_bytes(var_dict, index, selected)
+            var_dict['EstimatedOutputBytes'] = estimate['TotalBytes']
+            var_dict['EstimatedStageBytes'] = estimate['Stages']
+            counters['EstimatedOutputBytes'] = estimate['TotalBytes']
+            counters['FreeBytes'] = storage_estimate.check_free_space(estimate, output_path, args.disk_check)
+        print('Estimated output: %s (%s per montage)' % (storage_estimate.format_bytes(estimate['TotalBytes']),
+            storage_estimate.format_bytes(estimate['MontageBytes'])))
+
+        # check filenames for wells with missing timepoints, panels, or channels
+        # optionally also read TIFF headers for zero-byte, truncated or malformed images
+        if check_data_option in (1, 2):
+            with stats.stage('check_data') as counters:
+                counters['Rows'] = len(var_dict['AnalyzedFiles'])
+                selected = check_data(var_dict, index, selected, args.hash_workers if args.hash_extra_tiles else 0)
+                counters['FilesSelected'] = len(var_dict['AnalyzedFiles'])
+            if check_data_option == 2:
+                with stats.stage('check_image_headers') as counters:
+                    counters['Files'] = len(var_dict['AnalyzedFiles'])
+                    check_image_headers(var_dict, args.header_check_workers)
+
+        # per-image acquisition times from the full logs, summarized per well and timepoint
+        if args.index_logs:
+            with stats.stage('log_indexing') as counters:
+                var_dict['WellElapsedHours'] = get_well_hours(var_dict, index, selected, input_path, output_path, args.log_workers)
+                counters['Files'] = len(var_dict['AnalyzedFiles'])
+
+        # link the selection into a small pre-partitioned tree and point var_dict at it
+        if args.selection_view != 'none':
+            with stats.stage('selection_view') as counters:
+                view_path = os.path.join(output_path, selection_view.VIEW_DIR)
+                prefixes, prefix_codes, counts = selection_view.materialize_view(index, selected, view_path,
+                    args.selection_view, args.view_workers)
+                index = index.with_prefixes(prefixes, prefix_codes)
+                var_dict['RawImageData'] = view_path
+                # the view has its own folder layout; the input layout is kept alongside
+                var_dict['InputDirStructure'] = dir_structure
+                var_dict['DirStructure'] = selection_view.VIEW_DIR_STRUCTURE[args.selection_view]
+                var_dict['SelectionView'] = args.selection_view
+                var_dict['AnalyzedFiles'] = index.paths(selected)
+                counters.update(counts)
+            print('Selection view %s: %d links added, %d removed, %d unchanged, %d relinked to replaced files (%d symlinks)' % (
+                view_path, counts['Added'], counts['Removed'], counts['Kept'], counts['Refreshed'], counts['Symlinks']))
+
+        # ----Output for user and save dict----------
+        print('Input path:', input_path)
+        print('Input directory structure:', dir_structure)
+        print('Results output path:', output_path)
+
+        # split the selected files into shards for downstream fan-out
+        if args.work_plan.strip() != '':
+            with stats.stage('work_plan') as counters:
+                sizes = None
+                if args.shard_bytes:
+                    # sizes stat-ed by the crawl; only files it did not stat are stat-ed here
+                    sizes = index.file_sizes()
+                    unknown = selected & (sizes < 0)
+                    sizes[unknown] = work_plan.file_sizes(index.paths(unknown))
+                plan = work_plan.make_work_plan(var_dict, index, selected, args.shard_by,
+                    args.shard_files, args.shard_bytes, sizes)
+                work_plan.write_work_plan(plan, args.work_plan.strip())
+                counters['Shards'] = plan['NumberShards']
+            print('Work plan: %d shards by %s' % (plan['NumberShards'], args.shard_by))
+
+        with stats.stage('serialization') as counters:
+            # per-process temporary name so concurrent runs (batch mode) in one folder do not collide
+            tmp_outfile = 'var_dict.%d.p' % os.getpid()
+            if args.outfile_format == 'compact':
+                var_dict_store.write_compact(var_dict, index, selected, tmp_outfile)
+            else:
+                pickle.dump(var_dict, open(tmp_outfile, 'wb'))
+            counters['Bytes'] = os.path.getsize(tmp_outfile)
+            outfile = shutil.move(tmp_outfile, outfile)
+        light_utils.save_user_args_to_csv(args, output_path, 'create_folders'+'_'+timestamp)
+    except BaseException as e:
+        sidecar['Status'] = 'failed check' if isinstance(e, ValueError) else 'error'
+        sidecar['Error'] = '%s: %s' % (type(e).__name__, str(e).split('\n')[0])
+        raise
+    finally:
+        if stats_path is not None:
+            stats.write_json(stats_path, **sidecar)
+    print('Module run time:', stats.elapsed())
+    return var_dict
 
 
 if __name__ == "__main__":
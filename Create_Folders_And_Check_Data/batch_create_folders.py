@@ -0,0 +1,165 @@
+'''
+Batch mode for Create_Folders_And_Check_Data.
+Sets up and validates many plates at once: each row of a CSV plate list
+is run through the normal tool (folders, var_dict, missing/extra CSVs,
+timepoint_hours.csv, ...) in its own worker process, so a plate whose
+worker crashes or is killed (e.g. for running out of memory) only fails
+itself. A failing plate is recorded and does not stop the others, and one aggregated completeness
+summary is written for the whole batch. The output of each plate is
+logged in a folder next to the summary, so plates whose output folder is
+never created still have a log.
+
+The plate list has one row per plate; columns are named after the tool
+arguments. input_path, output_path and morph_channel are required; other
+columns fall back to the Galaxy form defaults, and outfile defaults to
+var_dict.p in the plate's output folder. Example:
+
+    input_path,output_path,morph_channel,chosen_wells
+    /gladstone/finkbeiner/robodata/ExpA,/gladstone/finkbeiner/lab/GXYTMP/ExpA,FITC,
+    /gladstone/finkbeiner/robodata/ExpB,/gladstone/finkbeiner/lab/GXYTMP/ExpB,RFP,A1-B12
+'''
+
+import os, sys, argparse, csv, glob, time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import redirect_stdout, redirect_stderr
+
+import Create_Folders_And_Check_Data as create_folders
+
+POSITIONAL_ARGS = ['input_path', 'output_path', 'dir_structure', 'robo_num', 'imaging_mode',
+    'morph_channel', 'pixel_overlap', 'wells_toggle', 'timepoints_toggle', 'channels_toggle',
+    'check_data_option', 'outfile']
+DEFAULTS = {'dir_structure': 'sub_dir', 'robo_num': '1', 'imaging_mode': 'epi', 'pixel_overlap': '30',
+    'wells_toggle': 'include', 'timepoints_toggle': 'include', 'channels_toggle': 'include',
+    'check_data_option': '1'}
+# on/off options of the tool, given as true/false columns in the plate list
+FLAG_ARGS = dict((action.dest, action.option_strings[0]) for action in create_folders.get_parser()._actions
+    if isinstance(action, argparse._StoreTrueAction))
+SUMMARY_COLUMNS = ['Plate', 'InputPath', 'OutputPath', 'Status', 'Message', 'NumberFiles',
+    'Wells', 'TimePoints', 'Channels', 'Reports', 'Log', 'Seconds']
+
+
+def plate_fields(plate):
+    '''Row of the plate list with surrounding whitespace removed.'''
+    return dict((key.strip(), (value or '').strip()) for key, value in plate.items() if key)
+
+def plate_argv(plate):
+    '''Tool argument list for one row of the plate list.'''
+    plate = plate_fields(plate)
+    for name in ['input_path', 'output_path', 'morph_channel']:
+        assert plate.get(name), 'Plate list row is missing %s: %s' % (name, plate)
+    values = dict(DEFAULTS)
+    values['outfile'] = os.path.join(plate['output_path'], 'var_dict.p')
+    values.update((key, value) for key, value in plate.items() if value != '')
+    argv = [values[name] for name in POSITIONAL_ARGS]
+    for key, value in values.items():
+        if key in POSITIONAL_ARGS or key in DEFAULTS:
+            continue
+        if key in FLAG_ARGS:
+            if value.lower() in ('1', 'true', 'yes'):
+                argv.append(FLAG_ARGS[key])
+        else:
+            argv.extend(['--' + key, value])
+    return argv
+
+def plate_result(plate, log_path):
+    '''Summary row of one plate, before it is run.'''
+    fields = plate_fields(plate)
+    output_path = fields.get('output_path', '')
+    result = dict((column, '') for column in SUMMARY_COLUMNS)
+    result.update({'Plate': os.path.basename(os.path.normpath(output_path)) if output_path else '',
+        'InputPath': fields.get('input_path', ''), 'OutputPath': output_path, 'Log': log_path})
+    return result
+
+def last_line(path):
+    with open(path) as f:
+        lines = [line.strip() for line in f if line.strip()]
+    return lines[-1] if lines else ''
+
+def run_plate(plate, log_path):
+    '''Run the tool for one plate, logging its output to log_path; never raises (short of an interrupt).'''
+    result = plate_result(plate, log_path)
+    output_path = result['OutputPath']
+    start = time.time()
+    try:
+        with open(log_path, 'w') as log, redirect_stdout(log), redirect_stderr(log):
+            argv = plate_argv(plate)
+            var_dict = create_folders.main(argv)
+        result.update({'Status': 'ok', 'NumberFiles': len(var_dict['AnalyzedFiles']),
+            'Wells': len(var_dict['Wells']), 'TimePoints': len(var_dict['TimePoints']),
+            'Channels': len(var_dict['Channels'])})
+    except ValueError as e:
+        # raised by the data checks, with their reports saved in the output folder
+        result.update({'Status': 'failed check', 'Message': str(e).split('\n')[0]})
+    except SystemExit as e:
+        # argparse rejected the row's arguments; its message is the last line of the log
+        result.update({'Status': 'error', 'Message': 'Invalid arguments (exit %s): %s' % (e.code, last_line(log_path))})
+    except KeyboardInterrupt:
+        raise
+    except BaseException as e:
+        result.update({'Status': 'error', 'Message': '%s: %s' % (type(e).__name__, str(e).split('\n')[0])})
+    if output_path:
+        reports = [path for pattern in ['*_missing-images.csv', '*_extra-images.csv', '*_corrupt-images.csv']
+            for path in glob.glob(os.path.join(output_path, pattern))]
+        result['Reports'] = ';'.join(sorted(reports))
+    result['Seconds'] = round(time.time() - start, 1)
+    return result
+
+def worker_failed(plate, log_path, e):
+    '''Summary row for a plate whose worker process died (e.g. killed for running out of memory).'''
+    result = plate_result(plate, log_path)
+    result.update({'Status': 'error', 'Message': '%s: %s' % (type(e).__name__, e)})
+    return result
+
+def run_plate_process(plate, log_path):
+    '''Run one plate in a worker process of its own; a crash of that process only fails this plate.'''
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        try:
+            return executor.submit(run_plate, plate, log_path).result()
+        except BrokenProcessPool as e:
+            return worker_failed(plate, log_path, e)
+
+def main():
+    '''Point of entry.'''
+
+    parser = argparse.ArgumentParser(description="Create folders and check data for many plates.")
+    parser.add_argument("plate_list",
+        help="CSV file with one row of tool arguments per plate.")
+    parser.add_argument("summary",
+        help="Path of the aggregated completeness summary (CSV).")
+    parser.add_argument("--processes",
+        dest="processes", type=int, default=os.cpu_count(),
+        help="Number of plates processed concurrently.")
+    args = parser.parse_args()
+
+    with open(args.plate_list, newline='') as f:
+        plates = list(csv.DictReader(f))
+    assert len(plates) > 0, 'No plates in %s' % args.plate_list
+
+    # one log per plate row, next to the summary
+    log_dir = os.path.splitext(args.summary)[0] + '_logs'
+    if not os.path.isdir(log_dir):
+        os.makedirs(log_dir)
+    log_paths = [os.path.join(log_dir, '%d_%s.log' % (i + 1,
+        os.path.basename(os.path.normpath(plate_fields(plate).get('output_path') or 'plate'))))
+        for i, plate in enumerate(plates)]
+
+    # the threads only wait on the plate processes
+    with ThreadPoolExecutor(max_workers=max(1, min(args.processes, len(plates)))) as executor:
+        results = list(executor.map(run_plate_process, plates, log_paths))
+
+    with open(args.summary, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_COLUMNS)
+        writer.writeheader()
+        writer.writerows(results)
+
+    for result in results:
+        print('%-30s %-12s %s' % (result['Plate'], result['Status'], result['Message']))
+    num_ok = len([result for result in results if result['Status'] == 'ok'])
+    print('%d of %d plates complete; summary saved to %s' % (num_ok, len(results), args.summary))
+    if num_ok < len(results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
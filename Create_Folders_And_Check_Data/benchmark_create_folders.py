@@ -0,0 +1,201 @@
+'''
+Benchmark for the create-folders/check-data path.
+Generates synthetic experiment trees (zero-byte or tiny .tif files plus
+*-T<n>.log files) in a temporary folder for the Robo0, Robo3 and Robo4
+naming schemes, in sub_dir and root_dir layouts, optionally with missing
+or duplicated tiles, then times each phase of the tool on them:
+crawl (the uncached manifest crawl the tool runs), token detection, include/exclude filtering, get_timepoint_hours,
+check_data and pickle output. Results are written as JSON so runs can be
+compared across versions. The root_dir crawl needs utils (OpenCV); where
+it cannot be imported, root_dir cases are recorded as skipped.
+
+Example:
+    python benchmark_create_folders.py --wells 96 --timepoints 10 --panels 25 --results bench.json
+'''
+
+import os, argparse, datetime, importlib.util, json, math, pickle, platform, random, shutil, tempfile, time
+
+import crawler
+import manifest
+import Create_Folders_And_Check_Data as create_folders
+
+SCHEMES = ['Robo0', 'Robo3', 'Robo4']
+LAYOUTS = ['sub_dir', 'root_dir']
+CHANNEL_NAMES = ['FITC-DFTrCy5', 'RFP-DFTrCy5', 'Cy5-DFTrCy5', 'DAPI-DFTrCy5', 'BRIGHTFIELD']
+PLATE_ID = 'PID20240101'
+EXPERIMENT = 'Bench'
+
+
+def plate_wells(num_wells):
+    '''Row-major well names for a plate with at least num_wells wells.'''
+    num_cols = 12 if num_wells <= 96 else 24
+    rows = 'ABCDEFGHIJKLMNOP'
+    return ['%s%d' % (rows[i // num_cols], i % num_cols + 1) for i in range(num_wells)]
+
+def make_filename(scheme, timepoint, hours, well, panel, channel):
+    if scheme == 'Robo3':
+        tokens = [PLATE_ID, EXPERIMENT, 'T%d' % timepoint, str(hours), well, str(panel), channel]
+    elif scheme == 'Robo0':
+        tokens = [PLATE_ID, EXPERIMENT, 'T%d' % timepoint, '%d-0' % hours, well, str(panel), channel,
+            '0', '0', '1']
+    elif scheme == 'Robo4':
+        tokens = [PLATE_ID, EXPERIMENT, 'T%d' % timepoint, str(hours), well, str(panel),
+            'FD1', 'FD2', 'FD3', channel, '0', '1', 'Cam1']
+    else:
+        raise ValueError('Unknown naming scheme: %s' % scheme)
+    return '_'.join(tokens) + '.tif'
+
+def generate_plate(root, scheme, layout, num_wells, num_timepoints, num_channels, num_panels,
+        missing_fraction=0.0, num_duplicates=0, tile_bytes=0, seed=0):
+    '''
+    Write a synthetic experiment under root.
+    Returns counts of generated, dropped and duplicated tiles.
+    '''
+    rng = random.Random(seed)
+    wells = plate_wells(num_wells)
+    channels = CHANNEL_NAMES[:num_channels]
+    payload = b'\0' * tile_bytes
+    start = datetime.datetime(2024, 1, 1, 9, 0, 0)
+    counts = {'Files': 0, 'Missing': 0, 'Duplicates': 0}
+    written = []
+    os.makedirs(root)
+    for timepoint in range(num_timepoints):
+        hours = timepoint * 24
+        first_image = None
+        for well in wells:
+            folder = os.path.join(root, well) if layout == 'sub_dir' else root
+            if not os.path.isdir(folder):
+                os.makedirs(folder)
+            for panel in range(1, num_panels + 1):
+                for channel in channels:
+                    if missing_fraction and rng.random() < missing_fraction:
+                        counts['Missing'] += 1
+                        continue
+                    name = make_filename(scheme, timepoint, hours, well, panel, channel)
+                    with open(os.path.join(folder, name), 'wb') as f:
+                        f.write(payload)
+                    written.append((folder, timepoint, hours, well, panel, channel))
+                    counts['Files'] += 1
+                    first_image = first_image or name
+        log_time = start + datetime.timedelta(hours=hours)
+        with open(os.path.join(root, '%s_%s-T%d.log' % (PLATE_ID, EXPERIMENT, timepoint)), 'w') as f:
+            f.write('%s -- %s\n' % (log_time.strftime('%y %m %d %H:%M:%S'), first_image))
+    # a duplicate is the same tile re-acquired under a different hours token
+    for folder, timepoint, hours, well, panel, channel in rng.sample(written, min(num_duplicates, len(written))):
+        name = make_filename(scheme, timepoint, hours + 1, well, panel, channel)
+        with open(os.path.join(folder, name), 'wb') as f:
+            f.write(payload)
+        counts['Duplicates'] += 1
+    return counts
+
+def run_case(work_dir, scheme, layout, args):
+    '''Generate one plate and time each phase of the tool on it.'''
+    case_dir = os.path.join(work_dir, '%s_%s' % (scheme, layout))
+    input_path = os.path.join(case_dir, 'raw')
+    output_path = os.path.join(case_dir, 'GXYTMP')
+    generated = generate_plate(input_path, scheme, layout, args.wells, args.timepoints, args.channels,
+        args.panels, args.missing, args.duplicates, args.tile_bytes, args.seed)
+    os.makedirs(output_path)
+
+    phases = {}
+    def timed(name, function, *function_args):
+        start = time.perf_counter()
+        result = function(*function_args)
+        phases[name] = time.perf_counter() - start
+        return result
+
+    index = timed('crawl', manifest.crawl_cached, input_path, layout, 1, output_path, True, args.crawl_workers)
+
+    var_dict = {'ImagingMode': 'confocal' if scheme == 'Robo4' else 'epi',
+        'GalaxyOutputPath': output_path, 'InputPath': input_path, 'DirStructure': layout}
+    timed('token_detection', create_folders.get_exp_params_general, var_dict, index, CHANNEL_NAMES[0], 1)
+    grid = int(math.sqrt(args.panels))
+    create_folders.get_array_dimensions(index, grid, args.panels // grid, var_dict)
+
+    def filter_files():
+        selected = index.select(Well=var_dict['Wells'], Timepoint=var_dict['TimePoints'], Channel=var_dict['Channels'])
+        var_dict['AnalyzedFiles'] = index.paths(selected)
+        return selected
+    selected = timed('filtering', filter_files)
+    var_dict['ElapsedHours'] = timed('timepoint_hours', create_folders.get_timepoint_hours,
+        var_dict['TimePoints'], input_path, output_path)
+
+    def check():
+        try:
+            create_folders.check_data(var_dict, index, selected)
+            return 'complete'
+        except ValueError as e:
+            return str(e).split(' (')[0]
+    check_result = timed('check_data', check)
+
+    def write_pickle():
+        with open(os.path.join(output_path, 'var_dict.p'), 'wb') as f:
+            pickle.dump(var_dict, f)
+    timed('pickle_output', write_pickle)
+
+    if not args.keep:
+        shutil.rmtree(case_dir)
+    return {'Scheme': scheme, 'Layout': layout, 'Generated': generated, 'Files': len(index),
+        'CheckResult': check_result, 'Phases': phases, 'Total': sum(phases.values())}
+
+def main():
+    '''Point of entry.'''
+
+    parser = argparse.ArgumentParser(description="Benchmark Create_Folders_And_Check_Data on synthetic plates.")
+    parser.add_argument("--schemes", default=','.join(SCHEMES),
+        help="Comma-separated naming schemes to generate (Robo0, Robo3, Robo4).")
+    parser.add_argument("--layouts", default=','.join(LAYOUTS),
+        help="Comma-separated folder layouts to generate (sub_dir, root_dir).")
+    parser.add_argument("--wells", type=int, default=96,
+        help="Number of wells.")
+    parser.add_argument("--timepoints", type=int, default=5,
+        help="Number of timepoints.")
+    parser.add_argument("--channels", type=int, default=2,
+        help="Number of channels (at most %d)." % len(CHANNEL_NAMES))
+    parser.add_argument("--panels", type=int, default=16,
+        help="Number of panels per montage (a perfect square).")
+    parser.add_argument("--missing", type=float, default=0.0,
+        help="Fraction of tiles to leave out.")
+    parser.add_argument("--duplicates", type=int, default=0,
+        help="Number of tiles to duplicate.")
+    parser.add_argument("--tile_bytes", type=int, default=0,
+        help="Size of each synthetic tile (0 for empty files).")
+    parser.add_argument("--crawl_workers", type=int, default=crawler.DEFAULT_WORKERS,
+        help="Number of folders listed concurrently.")
+    parser.add_argument("--seed", type=int, default=0,
+        help="Random seed for missing and duplicated tiles.")
+    parser.add_argument("--work_dir", default=None,
+        help="Folder for the synthetic plates (defaults to a temporary folder).")
+    parser.add_argument("--keep", action="store_true",
+        help="Keep the synthetic plates after the run.")
+    parser.add_argument("--results", default='create_folders_benchmark.json',
+        help="JSON file the results are written to.")
+    args = parser.parse_args()
+
+    assert 1 <= args.channels <= len(CHANNEL_NAMES), 'Number of channels must be between 1 and %d' % len(CHANNEL_NAMES)
+    work_dir = tempfile.mkdtemp(prefix='create_folders_bench_', dir=args.work_dir)
+    cases = []
+    try:
+        for scheme in args.schemes.split(','):
+            for layout in args.layouts.split(','):
+                if layout.strip() == 'root_dir' and importlib.util.find_spec('utils') is None:
+                    print('%s %s: skipped, utils is needed for the root_dir crawl' % (scheme, layout))
+                    cases.append({'Scheme': scheme.strip(), 'Layout': layout.strip(), 'Skipped': 'utils not importable'})
+                    continue
+                case = run_case(work_dir, scheme.strip(), layout.strip(), args)
+                print('%s %s: %d files, %.3f s (%s)' % (case['Scheme'], case['Layout'], case['Files'],
+                    case['Total'], ', '.join('%s %.3f' % item for item in case['Phases'].items())))
+                cases.append(case)
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    results = {'Timestamp': datetime.datetime.utcnow().isoformat(), 'Python': platform.python_version(),
+        'Host': platform.node(), 'Parameters': vars(args), 'Cases': cases}
+    with open(args.results, 'w') as f:
+        json.dump(results, f, indent=2)
+    print('Results written to', args.results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+'''
+Startup benchmark for Create_Folders_And_Check_Data.
+Runs the tool in a fresh interpreter on a small synthetic plate and
+reports interpreter + import time, run time and which heavy modules
+(pandas, OpenCV via utils, ...) were loaded. With check_data_option 0
+none of them should be; the script exits non-zero if one was, so it can
+guard the fast path in CI.
+
+Example:
+    python benchmark_startup.py --repeat 5 --results startup.json
+'''
+
+import os, sys, argparse, json, shutil, subprocess, tempfile, time
+
+import benchmark_create_folders
+
+HEAVY_MODULES = ['pandas', 'utils', 'cv2', 'scipy', 'skimage', 'matplotlib']
+RESULT_MARKER = 'STARTUP_RESULT '
+
+CHILD_SCRIPT = '''
+import sys, json, time
+start = time.perf_counter()
+import Create_Folders_And_Check_Data as create_folders
+imported = time.perf_counter()
+sys.argv = json.loads(sys.argv[1])
+create_folders.main()
+done = time.perf_counter()
+print(%r + json.dumps({'ImportSeconds': imported - start, 'RunSeconds': done - imported,
+    'HeavyModules': [m for m in %r if m in sys.modules]}))
+''' % (RESULT_MARKER, HEAVY_MODULES)
+
+
+def run_once(work_dir, input_path, check_data_option, morph_channel):
+    '''Run the tool in a new interpreter; return its timings and loaded heavy modules.'''
+    output_path = os.path.join(work_dir, 'gladstone', 'finkbeiner', 'GXYTMP_startup')
+    shutil.rmtree(output_path, ignore_errors=True)
+    tool_args = ['Create_Folders_And_Check_Data.py', input_path, output_path, 'sub_dir', '1', 'epi',
+        morph_channel, '30', 'include', 'include', 'include', str(check_data_option),
+        os.path.join(work_dir, 'var_dict.out')]
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([os.path.dirname(os.path.abspath(__file__)), env.get('PYTHONPATH', '')])
+    start = time.perf_counter()
+    completed = subprocess.run([sys.executable, '-c', CHILD_SCRIPT, json.dumps(tool_args)],
+        cwd=work_dir, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    wall = time.perf_counter() - start
+    if completed.returncode != 0:
+        raise RuntimeError('Tool run failed:\n%s' % completed.stderr)
+    result_line = [line for line in completed.stdout.splitlines() if line.startswith(RESULT_MARKER)][-1]
+    result = json.loads(result_line[len(RESULT_MARKER):])
+    result['WallSeconds'] = wall
+    return result
+
+def main():
+    '''Point of entry.'''
+
+    parser = argparse.ArgumentParser(description="Measure startup cost of Create_Folders_And_Check_Data.")
+    parser.add_argument("--check_data_option", type=int, choices=[0, 1], default=0,
+        help="check_data_option passed to the tool (0 is the fast path).")
+    parser.add_argument("--repeat", type=int, default=3,
+        help="Number of fresh-interpreter runs.")
+    parser.add_argument("--wells", type=int, default=8,
+        help="Number of wells in the synthetic plate.")
+    parser.add_argument("--results", default='create_folders_startup.json',
+        help="JSON file the results are written to.")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='create_folders_startup_')
+    try:
+        input_path = os.path.join(work_dir, 'raw')
+        benchmark_create_folders.generate_plate(input_path, 'Robo3', 'sub_dir', args.wells, 2, 2, 4)
+        os.makedirs(os.path.join(work_dir, 'gladstone', 'finkbeiner'))
+        morph_channel = benchmark_create_folders.CHANNEL_NAMES[0]
+        runs = [run_once(work_dir, input_path, args.check_data_option, morph_channel) for i in range(args.repeat)]
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    heavy = sorted(set(module for run in runs for module in run['HeavyModules']))
+    summary = {'CheckDataOption': args.check_data_option, 'Runs': runs, 'HeavyModules': heavy,
+        'MinWallSeconds': min(run['WallSeconds'] for run in runs),
+        'MinImportSeconds': min(run['ImportSeconds'] for run in runs)}
+    with open(args.results, 'w') as f:
+        json.dump(summary, f, indent=2)
+    print('Wall %.3f s, import %.3f s (best of %d); heavy modules loaded: %s' % (
+        summary['MinWallSeconds'], summary['MinImportSeconds'], len(runs), ', '.join(heavy) or 'none'))
+    if args.check_data_option == 0 and heavy:
+        sys.exit('Fast path loaded heavy modules: %s' % ', '.join(heavy))
+
+
+if __name__ == "__main__":
+    main()
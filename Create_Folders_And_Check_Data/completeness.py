@@ -0,0 +1,160 @@
+'''
+Vectorized completeness check.
+Selected files are counted into one dense occupancy tensor over
+Well x Timepoint x Channel x Panel built from the integer-coded file
+index; missing and extra tiles then come out of array comparisons
+instead of per-timepoint groupby/merge passes.
+'''
+
+import numpy as np
+
+import file_index
+
+
+class Occupancy(object):
+    '''File counts per Well x Timepoint x Channel x Panel for the selected rows of a FileIndex.'''
+
+    def __init__(self, index, mask, wells, timepoints, channels, num_panels):
+        self.wells = list(wells)
+        self.timepoints = [int(x.replace('T', '')) for x in timepoints]
+        self.channels = list(channels)
+        self.num_panels = num_panels
+
+        rows = np.flatnonzero(mask)
+        w = index.axis_positions('Well', self.wells)[rows]
+        t = index.axis_positions('Timepoint', timepoints)[rows]
+        c = index.axis_positions('Channel', self.channels)[rows]
+        keep = (w >= 0) & (t >= 0) & (c >= 0)
+        self.rows = rows[keep]
+        panel_numbers = index.numeric('Panel')[self.rows]
+        # panel axis covers the expected grid plus any out-of-range panel numbers seen
+        self.panels = np.union1d(np.arange(1, num_panels + 1), panel_numbers)
+        self.coords = (w[keep], t[keep], c[keep], np.searchsorted(self.panels, panel_numbers))
+
+        self.shape = (len(self.wells), len(self.timepoints), len(self.channels), len(self.panels))
+        flat = np.ravel_multi_index(self.coords, self.shape)
+        self.counts = np.bincount(flat, minlength=int(np.prod(self.shape))).reshape(self.shape)
+
+    def problem_wells(self):
+        '''
+        Return (incomplete, extra) boolean arrays over the well axis, using the same
+        three tests as before: panels per well/timepoint/channel, timepoints per
+        well/channel and channels per well/timepoint/panel. Only groups with at
+        least one file take part, as with a groupby.
+        '''
+        incomplete = np.zeros(len(self.wells), dtype=bool)
+        extra = np.zeros(len(self.wells), dtype=bool)
+
+        panel_counts = self.counts.sum(axis=3)
+        incomplete |= ((panel_counts > 0) & (panel_counts < self.num_panels)).any(axis=(1, 2))
+        extra |= (panel_counts > self.num_panels).any(axis=(1, 2))
+
+        timepoint_counts = (panel_counts > 0).sum(axis=1)
+        incomplete |= ((timepoint_counts > 0) & (timepoint_counts < len(self.timepoints))).any(axis=1)
+        extra |= (timepoint_counts > len(self.timepoints)).any(axis=1)
+
+        channel_counts = self.counts.sum(axis=2)
+        incomplete |= ((channel_counts > 0) & (channel_counts < len(self.channels))).any(axis=(1, 2))
+        extra |= (channel_counts > len(self.channels)).any(axis=(1, 2))
+
+        return incomplete, extra
+
+    def well_channel_pairs(self, selected_wells):
+        '''(well, channel) axis positions with files in the selected wells, in order of first file.'''
+        w, t, c, p = self.coords
+        keys = w * len(self.channels) + c
+        keys_in = selected_wells[w]
+        unique_keys, first = np.unique(keys[keys_in], return_index=True)
+        ordered = unique_keys[np.argsort(first)]
+        return [divmod(int(key), len(self.channels)) for key in ordered]
+
+    def missing_tiles(self, selected_wells):
+        '''Rows of [Well, Channel, missing tiles per timepoint] for the selected wells.'''
+        expected = (self.panels >= 1) & (self.panels <= self.num_panels)
+        panel_names = np.array([str(x) for x in self.panels[expected]], dtype=object)
+        missing = self.counts[..., expected] == 0
+        table = []
+        for w, c in self.well_channel_pairs(selected_wells):
+            table.append([self.wells[w], self.channels[c]] +
+                [','.join(panel_names[missing[w, t, c]]) for t in range(len(self.timepoints))])
+        return table
+
+    def extra_tiles(self, selected_wells):
+        '''
+        Rows of [Well, Channel, duplicated tiles per timepoint] for the selected wells.
+        Duplicates are {panel: count} in order of first file; well/channel/timepoints
+        without any file list every panel, as the per-timepoint merge did.
+        '''
+        w, t, c, p = self.coords
+        in_wells = selected_wells[w]
+        flat = np.ravel_multi_index((w[in_wells], t[in_wells], c[in_wells], p[in_wells]), self.shape)
+        unique_flat, first, counts = np.unique(flat, return_index=True, return_counts=True)
+        duplicated = counts > 1
+        order = np.argsort(first[duplicated])
+        duplicates = {}
+        for key, count in zip(unique_flat[duplicated][order], counts[duplicated][order]):
+            dw, dt, dc, dp = [int(x) for x in np.unravel_index(key, self.shape)]
+            duplicates.setdefault((dw, dt, dc), {})[int(self.panels[dp])] = int(count)
+
+        all_panels = ','.join([str(i) for i in range(1, self.num_panels + 1)])
+        has_files = self.counts.sum(axis=3) > 0
+        table = []
+        for w, c in self.well_channel_pairs(selected_wells):
+            row = [self.wells[w], self.channels[c]]
+            for t in range(len(self.timepoints)):
+                row.append(duplicates.get((w, t, c), {}) if has_files[w, t, c] else all_panels)
+            table.append(row)
+        return table
+
+    def duplicate_cells(self, selected_wells):
+        '''
+        [((well, timepoint, channel, panel) axis positions, index rows)] for every tile
+        with more than one file in the selected wells, in order of first file.
+        '''
+        in_wells = selected_wells[self.coords[0]]
+        flat = np.ravel_multi_index(self.coords, self.shape)[in_wells]
+        rows = self.rows[in_wells]
+        order = np.argsort(flat, kind='stable')
+        flat, rows = flat[order], rows[order]
+        starts = np.flatnonzero(np.r_[True, flat[1:] != flat[:-1]])
+        ends = np.r_[starts[1:], len(flat)]
+        cells = [(tuple(int(x) for x in np.unravel_index(flat[start], self.shape)), rows[start:end])
+            for start, end in zip(starts, ends) if end - start > 1]
+        cells.sort(key=lambda cell: cell[1][0])
+        return cells
+
+
+class IncrementalCompleteness(object):
+    '''
+    Running tile counts for files that arrive one at a time (watch mode).
+    Adding a file is O(1); a timepoint report is built from the counts
+    with the same missing/extra semantics as check_data.
+    '''
+
+    def __init__(self):
+        self.counts = {}
+        self.wells = set()
+        self.channels = set()
+        self.max_panel = 0
+
+    def add(self, well, timepoint, channel, panel):
+        tiles = self.counts.setdefault((timepoint, well, channel), {})
+        tiles[panel] = tiles.get(panel, 0) + 1
+        self.wells.add(well)
+        self.channels.add(channel)
+        self.max_panel = max(self.max_panel, panel)
+
+    def timepoint_report(self, timepoint, num_panels):
+        '''
+        Rows of [Well, Channel, missing tiles, extra tiles] for every well/channel
+        seen so far that is incomplete or has duplicated tiles at the timepoint.
+        '''
+        rows = []
+        for well in sorted(self.wells, key=file_index.well_sort_key):
+            for channel in sorted(self.channels):
+                tiles = self.counts.get((timepoint, well, channel), {})
+                missing = [str(i) for i in range(1, num_panels + 1) if i not in tiles]
+                extra = dict((panel, count) for panel, count in tiles.items() if count > 1)
+                if missing or extra:
+                    rows.append([well, channel, ','.join(missing), extra if extra else ''])
+        return rows
@@ -0,0 +1,105 @@
+'''
+Crawler for raw image folders.
+With the sub_dir layout (one folder per well) the well folders are
+listed concurrently with os.scandir on a bounded thread pool, since
+per-directory latency dominates on network storage. Non-image and
+fiducial files are dropped during the scan and basenames are streamed
+straight into the file index, together with the file sizes stat-ed by
+the same scan worker.
+'''
+
+import os, re, time
+from glob import iglob
+from concurrent.futures import ThreadPoolExecutor
+
+
+FIDUCIAL_MARKER = 'FIDUCIARY'
+DEFAULT_WORKERS = 16
+# coarsest directory mtime resolution expected on the lab storage (NFS can be 1 s)
+MTIME_GRANULARITY_NS = 2 * 10**9
+# timepoint of an acquisition log, e.g. PID20200101_Exp1-T3.log
+TIMEPOINT_LOG_PATTERN = re.compile(r'(?<=-T)\d{1,2}(?=\.log)')
+
+
+def is_image_file(name):
+    '''True for tiff images that are not fiducial images.'''
+    return name.endswith('.tif') and FIDUCIAL_MARKER not in name
+
+def scan_dir(dir_path):
+    '''
+    List one directory with a single scandir call.
+    Returns (sorted image basenames, their sizes in bytes, sorted subdirectory paths).
+    '''
+    images = []
+    subdirs = []
+    with os.scandir(dir_path) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                subdirs.append(entry.path)
+            elif is_image_file(entry.name) and entry.is_file():
+                images.append((entry.name, entry.stat().st_size))
+    images.sort()
+    subdirs.sort()
+    return [name for name, size in images], [size for name, size in images], subdirs
+
+def get_timepoint_logs(input_path):
+    '''
+    Return [(timepoint, log path)] for the per-timepoint acquisition logs
+    in input_path, sorted by timepoint. ImageStart logs are skipped.
+    '''
+    logs = []
+    for log_path in iglob(os.path.join(input_path, '*.log')):
+        if 'ImageStart' in os.path.basename(log_path):
+            continue
+        match = TIMEPOINT_LOG_PATTERN.search(log_path)
+        if match is None:
+            raise ValueError('Cannot find the timepoint in log file name: %s' % log_path)
+        logs.append((match.group(0), log_path))
+    logs.sort(key=lambda log: int(log[0]))
+    return logs
+
+def list_dir(dir_path, cached_dirs):
+    '''
+    Return ((mtime, images, subdirs, sizes, scan time), relisted) for one directory.
+    A cached listing is reused when the directory mtime is unchanged and the
+    listing was made well after that mtime. A file added in the same mtime tick
+    as a scan leaves the mtime unchanged, so a listing scanned within
+    MTIME_GRANULARITY_NS of its mtime is never trusted and the folder is listed again.
+    '''
+    scanned = time.time_ns()
+    mtime = os.stat(dir_path).st_mtime_ns
+    cached = cached_dirs.get(dir_path)
+    if cached is not None and cached[0] == mtime and cached[4] - mtime > MTIME_GRANULARITY_NS:
+        return cached, False
+    images, sizes, subdirs = scan_dir(dir_path)
+    return (mtime, images, subdirs, sizes, scanned), True
+
+def add_listing(index, dir_path, images, sizes):
+    prefix = os.path.join(dir_path, '')
+    for name, size in zip(images, sizes):
+        index.add(prefix, name, size)
+
+def crawl_sub_dir(input_path, index, workers=DEFAULT_WORKERS, cached_dirs=None):
+    '''
+    Crawl input_path and its subfolders level by level, listing the
+    folders of each level concurrently. Files are added to the index (if
+    given) in directory order, so the result does not depend on thread timing.
+    Returns (listing per directory in crawl order, number of directories relisted).
+    '''
+    cached_dirs = cached_dirs or {}
+    dirs = {}
+    num_relisted = 0
+    level = [input_path]
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        while level:
+            next_level = []
+            listings = executor.map(lambda dir_path: list_dir(dir_path, cached_dirs), level)
+            for dir_path, (listing, relisted) in zip(level, listings):
+                mtime, images, subdirs, sizes, scanned = listing
+                if index is not None:
+                    add_listing(index, dir_path, images, sizes)
+                next_level.extend(subdirs)
+                dirs[dir_path] = listing
+                num_relisted += relisted
+            level = next_level
+    return dirs, num_relisted
@@ -0,0 +1,278 @@
+'''
+Columnar index of image filenames.
+Each filename is tokenized once; every token position is stored as an
+integer-coded column (distinct values + one code per file) so metadata
+getters, include/exclude filtering and the completeness check can all
+read from the same table instead of re-splitting basenames.
+'''
+
+import os, copy
+from array import array
+
+import numpy as np
+
+import token_schemes
+
+
+def well_sort_key(well):
+    '''Order wells by row letters, then numerically by column (A2 before A10).'''
+    letters = well.rstrip('0123456789')
+    digits = well[len(letters):]
+    return (len(letters), letters, int(digits) if digits else -1)
+
+
+def token_sort_key(token):
+    '''Order tokens numerically where possible (T2 before T10), otherwise lexically.'''
+    digits = token.lstrip('T')
+    if digits.isdigit():
+        return (0, int(digits), token)
+    return (1, 0, token)
+
+
+class _Column(object):
+    '''Integer-coded column: list of distinct values plus one code per row (-1 if absent).'''
+
+    def __init__(self, num_rows=0):
+        self.values = []
+        self.lookup = {}
+        self.codes = array('i', [-1]) * num_rows
+
+    def append(self, value):
+        code = self.lookup.get(value)
+        if code is None:
+            code = len(self.values)
+            self.lookup[value] = code
+            self.values.append(value)
+        self.codes.append(code)
+
+
+class FileIndex(object):
+    '''
+    Single-pass index of image files.
+    Paths are stored as a directory-prefix dictionary plus basenames,
+    tokens as one integer-coded column per position, and file sizes
+    (where the crawl stat-ed them) alongside.
+    '''
+
+    def __init__(self, paths=()):
+        self.prefixes = []
+        self._prefix_lookup = {}
+        self.prefix_codes = array('i')
+        self.basenames = []
+        self.sizes = array('q')
+        self.columns = []
+        self.bursts = _Column()
+        self.layout = None
+        self.derived = {}
+        self.extend(paths)
+
+    def __len__(self):
+        return len(self.basenames)
+
+    def add(self, prefix, basename, size=-1):
+        '''
+        Add one file given its directory prefix (including trailing separator),
+        basename and size in bytes (-1 if not known).
+        '''
+        code = self._prefix_lookup.get(prefix)
+        if code is None:
+            code = len(self.prefixes)
+            self._prefix_lookup[prefix] = code
+            self.prefixes.append(prefix)
+        num_rows = len(self.basenames)
+        self.prefix_codes.append(code)
+        self.basenames.append(basename)
+        self.sizes.append(size)
+
+        tokens = os.path.splitext(basename)[0].split('_')
+        while len(self.columns) < len(tokens):
+            self.columns.append(_Column(num_rows))
+        for column, token in zip(self.columns, tokens):
+            column.append(token)
+        for column in self.columns[len(tokens):]:
+            column.codes.append(-1)
+
+    def add_path(self, path):
+        base = os.path.basename(path)
+        self.add(path[:len(path) - len(base)], base)
+
+    def extend(self, paths):
+        for path in paths:
+            self.add_path(path)
+
+    def path(self, row):
+        return self.prefixes[self.prefix_codes[row]] + self.basenames[row]
+
+    def paths(self, mask=None):
+        '''Full paths, in crawl order, optionally restricted by a boolean mask.'''
+        if mask is None:
+            return [self.path(row) for row in range(len(self))]
+        return [self.path(row) for row in np.flatnonzero(mask)]
+
+    def with_prefixes(self, prefixes, prefix_codes):
+        '''
+        Shallow copy of the index whose rows live in other folders (e.g. a linked view);
+        tokens are shared with this index. Rows with prefix code -1 have no path.
+        '''
+        moved = copy.copy(self)
+        moved.prefixes = list(prefixes)
+        moved._prefix_lookup = dict((prefix, code) for code, prefix in enumerate(moved.prefixes))
+        moved.prefix_codes = array('i', np.asarray(prefix_codes, dtype=np.int32).tobytes())
+        return moved
+
+    def file_sizes(self, mask=None):
+        '''File sizes in bytes as a NumPy array (-1 where not known), optionally masked.'''
+        sizes = np.array(self.sizes, dtype=np.int64)
+        return sizes if mask is None else sizes[mask]
+
+    def set_layout(self, scheme_codes):
+        '''
+        Name the token columns from the naming scheme of each row (token_schemes.classify).
+        A column whose token position differs between the schemes present (e.g. Channel
+        in Robo4 confocal names with two or three filters) is gathered into a derived
+        column; rows without the column, or of no known scheme, get code -1. The burst
+        column is decoded from the distinct Hours-BurstIndex tokens of the schemes that have one.
+        '''
+        scheme_codes = np.asarray(scheme_codes)
+        present = np.unique(scheme_codes)
+        layouts = dict((code, token_schemes.get_layout(token_schemes.SCHEMES[code])) for code in present if code >= 0)
+        self.bursts = _Column()
+        burst_codes = np.full(len(self), -1, dtype=np.int32)
+        for code, layout in layouts.items():
+            if layout.get('Burst') == token_schemes.BURST:
+                self._gather(self.bursts, self.columns[layout['Hours']], scheme_codes == code, burst_codes,
+                    lambda token: token.partition('-')[2])
+        self.bursts.values = sorted(self.bursts.lookup, key=self.bursts.lookup.get)
+        self.bursts.codes = array('i', burst_codes.tobytes())
+        names = []
+        for layout in layouts.values():
+            names.extend(name for name in layout if name not in names)
+        self.layout = {}
+        self.derived = {}
+        for name in names:
+            positions = set(layouts.get(code, {}).get(name) for code in present)
+            if len(positions) == 1:
+                self.layout[name] = positions.pop()
+                continue
+            column = _Column()
+            codes = np.full(len(self), -1, dtype=np.int32)
+            for code, layout in layouts.items():
+                if name not in layout:
+                    continue
+                self._gather(column, self._column_at(layout[name]), scheme_codes == code, codes)
+            column.values = sorted(column.lookup, key=column.lookup.get)
+            column.codes = array('i', codes.tobytes())
+            self.derived[name] = column
+            self.layout[name] = name
+
+    def _gather(self, column, source, rows, codes, convert=None):
+        '''Copy the codes of source at rows into codes, recoded to the values of column (optionally converted).'''
+        values = source.values if convert is None else [convert(value) for value in source.values]
+        lookup = np.array([column.lookup.setdefault(value, len(column.lookup)) for value in values] + [-1],
+            dtype=np.int32)
+        codes[rows] = lookup[np.asarray(source.codes, dtype=np.int32)[rows]]
+
+    def _column_at(self, position):
+        if position == token_schemes.BURST:
+            return self.bursts
+        return self.columns[position]
+
+    def _column(self, name):
+        position = self.layout[name]
+        if position in self.derived:
+            return self.derived[position]
+        return self._column_at(position)
+
+    def has_column(self, name):
+        if self.layout.get(name) is None:
+            return False
+        position = self.layout[name]
+        return position in self.derived or position == token_schemes.BURST or position < len(self.columns)
+
+    def codes(self, name):
+        '''Integer codes of a named column as a NumPy array.'''
+        return np.array(self._column(name).codes, dtype=np.int32)
+
+    def values(self, name):
+        '''Distinct values of a named column, indexed by code.'''
+        return self._column(name).values
+
+    def unique(self, name, mask=None):
+        '''Distinct values of a named column present in the (masked) rows.'''
+        if not self.has_column(name):
+            return []
+        codes = self.codes(name)
+        if mask is not None:
+            codes = codes[mask]
+        values = self.values(name)
+        return [values[code] for code in np.unique(codes[codes >= 0])]
+
+    def axis_positions(self, name, axis_values, missing=-1):
+        '''
+        Position of every row's value of a named column along an axis (e.g. the selected
+        wells), as a NumPy array; missing for values not on the axis and absent tokens.
+        '''
+        position = dict((value, i) for i, value in enumerate(axis_values))
+        lookup = np.array([position.get(value, missing) for value in self.values(name)] + [missing], dtype=np.int64)
+        return lookup[self.codes(name)]
+
+    def numeric(self, name):
+        '''Column decoded to integers (e.g. Panel, or Timepoint without its T prefix).'''
+        lookup = np.array([int(x.lstrip('T')) for x in self.values(name)] + [-1], dtype=np.int64)
+        return lookup[self.codes(name)]
+
+    def select(self, **selections):
+        '''
+        Boolean row mask keeping rows whose named columns fall in the given values,
+        e.g. select(Well=['A1','B2'], Channel=['FITC']).
+        '''
+        mask = np.ones(len(self), dtype=bool)
+        for name, selected in selections.items():
+            values = self.values(name)
+            # extra trailing slot so that code -1 (token absent) is never allowed
+            allowed = np.zeros(len(values) + 1, dtype=bool)
+            selected = set(selected)
+            for code, value in enumerate(values):
+                allowed[code] = value in selected
+            mask &= allowed[self.codes(name)]
+        return mask
+
+
+def get_timepoints(index, mask=None):
+    return sorted(index.unique('Timepoint', mask), key=token_sort_key)
+
+def get_wells(index, mask=None):
+    return sorted(index.unique('Well', mask), key=well_sort_key)
+
+def get_channels(index, mask=None):
+    return sorted(index.unique('Channel', mask))
+
+def get_plate_id(index, mask=None):
+    return index.unique('PlateID', mask)[0]
+
+def get_experiment_name(index, mask=None):
+    return index.unique('ExptName', mask)[0]
+
+def get_bursts(index, mask=None):
+    return sorted(index.unique('Burst', mask), key=token_sort_key)
+
+def get_burst_iter(index, mask=None):
+    return sorted(index.unique('Hours', mask), key=token_sort_key) if index.has_column('Burst') else []
+
+def get_depths(index, mask=None):
+    return sorted(index.unique('Depth', mask), key=token_sort_key)
+
+def well_timepoint_order(index, mask, wells, timepoints):
+    '''
+    Masked rows in plate order: by position in wells, then in timepoints (stable, so
+    crawl order within a group; rows off either axis last).
+    Returns (order of the masked rows, sorted rows, their well positions, their timepoint positions).
+    '''
+    rows = np.flatnonzero(mask)
+    row_wells = index.axis_positions('Well', wells, len(wells))[rows]
+    row_tps = index.axis_positions('Timepoint', timepoints, len(timepoints))[rows]
+    order = np.lexsort((row_tps, row_wells))
+    return order, rows[order], row_wells[order], row_tps[order]
+
+def get_max_panel(index):
+    return int(index.numeric('Panel').max())
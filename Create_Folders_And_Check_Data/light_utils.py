@@ -0,0 +1,80 @@
+'''
+Standard-library versions of the utils helpers used on the fast path.
+Importing utils pulls in OpenCV and friends, which costs seconds on a
+cold shared conda env, so folder creation, selection parsing and the
+argument log use these instead. utils is only imported for the legacy
+root_dir crawl.
+'''
+
+import os, csv, datetime
+
+# rows and columns of the standard plates, smallest first
+PLATE_LAYOUTS = [('ABCDEFGH', 12), ('ABCDEFGHIJKLMNOP', 24)]
+
+
+def create_dir(path):
+    '''Create a folder (and parents) if it does not exist.'''
+    if not os.path.exists(path):
+        os.makedirs(path)
+
+def create_folder_hierarchy(subdirs, output_path):
+    '''Create the output folder and each of its result subfolders.'''
+    create_dir(output_path)
+    for subdir in subdirs:
+        create_dir(subdir)
+
+def update_timestring():
+    '''Timestamp used to tag files written by this run.'''
+    return datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+
+def save_user_args_to_csv(args, output_path, name):
+    '''Save the parsed command line arguments as name.csv in output_path.'''
+    with open(os.path.join(output_path, name + '.csv'), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Argument', 'Value'])
+        for key, value in sorted(vars(args).items()):
+            writer.writerow([key, value])
+
+def get_ref_channel(ref_channel, channels):
+    '''
+    Return the channel matching the given identifier:
+    an exact match, otherwise the only channel containing it.
+    '''
+    if ref_channel in channels:
+        return ref_channel
+    matches = [channel for channel in channels if ref_channel in channel]
+    assert len(matches) == 1, 'Channel identifier (%s) must match exactly one of the channels (%s)' % (ref_channel, ', '.join(channels))
+    return matches[0]
+
+def plate_wells(wells):
+    '''Wells of the smallest standard plate (96 or 384 wells) holding the given wells, in plate order.'''
+    for rows, num_cols in PLATE_LAYOUTS:
+        plate = ['%s%d' % (row, col) for row in rows for col in range(1, num_cols + 1)]
+        if set(wells).issubset(plate):
+            return plate
+    return plate
+
+def get_iter_from_user(user_input, kind):
+    '''
+    Expand a comma-separated selection such as "A3,B11-D2" or "T3,T5-T10".
+    Timepoint ranges are numeric and keep the zero padding of their first
+    timepoint ("T01-T03" gives T01, T02, T03). Well ranges run in plate order over the
+    whole plate, whether or not the dataset has every well in them.
+    '''
+    selection = []
+    for item in user_input.split(','):
+        item = item.strip()
+        if item == '':
+            continue
+        if '-' not in item:
+            selection.append(item)
+            continue
+        first, last = [x.strip() for x in item.split('-', 1)]
+        if kind == 'timepoints':
+            digits = first.lstrip('T')
+            selection.extend(['T%0*d' % (len(digits), tp) for tp in range(int(digits), int(last.lstrip('T')) + 1)])
+        else:
+            wells = plate_wells([first, last])
+            assert first in wells and last in wells, 'Confirm that the well range (%s) is on a 96- or 384-well plate' % item
+            selection.extend(wells[wells.index(first):wells.index(last) + 1])
+    return selection
@@ -0,0 +1,128 @@
+'''
+Index of the acquisition logs.
+Streams every *.log in the input folder (per-timepoint and ImageStart
+logs) line by line on a process pool and maps each logged image to its
+acquisition time, so per-well and per-image times are available for
+kinetic analysis. Lines look like
+
+    20 01 03 10:00:00 -- PID20200101_Exp1_T2_48-0_A1_1_FITC.tif
+
+Times are kept as whole seconds since EPOCH in one int64 array next to
+the image names; an image logged more than once keeps its earliest time.
+'''
+
+import os, csv, datetime, re
+from glob import glob
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+DEFAULT_WORKERS = 8
+EPOCH = datetime.datetime(2000, 1, 1)
+LOG_LINE_PATTERN = re.compile(r'^(\d\d) (\d\d) (\d\d) (\d\d):(\d\d):(\d\d) -- (.+?)\s*$')
+
+
+def image_key(name):
+    '''Join key of an image: its basename without extension (logs may hold Windows paths).'''
+    return os.path.splitext(os.path.basename(name.replace('\\', '/')))[0]
+
+def read_log(log_path):
+    '''
+    Stream one log and return (image keys, acquisition seconds since EPOCH)
+    for every line naming an image.
+    '''
+    keys = []
+    seconds = []
+    days = {}
+    with open(log_path, 'r', errors='replace') as f:
+        for line in f:
+            match = LOG_LINE_PATTERN.match(line)
+            if match is None:
+                continue
+            yy, mm, dd, hh, mi, ss, image = match.groups()
+            day = days.get((yy, mm, dd))
+            if day is None:
+                day = days[(yy, mm, dd)] = int((datetime.datetime(2000 + int(yy), int(mm), int(dd)) - EPOCH).total_seconds())
+            keys.append(image_key(image))
+            seconds.append(day + int(hh) * 3600 + int(mi) * 60 + int(ss))
+    return keys, np.array(seconds, dtype=np.int64)
+
+
+class LogIndex(object):
+    '''Image key -> earliest logged acquisition time, over all logs of an experiment.'''
+
+    def __init__(self, keys=(), seconds=()):
+        self.keys = list(keys)
+        self.seconds = np.asarray(seconds, dtype=np.int64)
+        self.lookup = dict((key, i) for i, key in enumerate(self.keys))
+
+    def start(self):
+        '''Seconds of the first logged image of the experiment.'''
+        return int(self.seconds.min()) if len(self.seconds) else 0
+
+    @classmethod
+    def from_logs(cls, log_paths, workers=DEFAULT_WORKERS):
+        '''Read the logs on a process pool and keep the earliest time per image.'''
+        with ProcessPoolExecutor(max_workers=max(1, min(workers, len(log_paths) or 1))) as executor:
+            results = list(executor.map(read_log, log_paths))
+        keys = [key for log_keys, log_seconds in results for key in log_keys]
+        seconds = np.concatenate([log_seconds for log_keys, log_seconds in results] or [np.zeros(0, dtype=np.int64)])
+        # earliest entry per image: sort by time, keep the first occurrence of each key
+        order = np.argsort(seconds, kind='stable')
+        earliest = {}
+        for i in order:
+            earliest.setdefault(keys[i], seconds[i])
+        return cls(earliest.keys(), list(earliest.values()))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def times(self, index, mask=None):
+        '''Acquisition seconds of the (masked) rows of a FileIndex, -1 where the image is not logged.'''
+        rows = np.arange(len(index)) if mask is None else np.flatnonzero(mask)
+        positions = np.array([self.lookup.get(image_key(index.basenames[row]), len(self.keys)) for row in rows],
+            dtype=np.int64)
+        return np.r_[self.seconds, -1][positions]
+
+
+def get_log_files(input_path):
+    '''All acquisition logs of an experiment, including ImageStart logs.'''
+    return sorted(glob(os.path.join(input_path, '*.log')))
+
+def to_datetime(seconds):
+    return EPOCH + datetime.timedelta(seconds=int(seconds))
+
+def write_image_times(path, index, mask, times):
+    '''CSV of Filename, AcquisitionDate, AcquisitionTime for the logged (masked) rows.'''
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Filename', 'AcquisitionDate', 'AcquisitionTime'])
+        for row, seconds in zip(np.flatnonzero(mask), times):
+            if seconds >= 0:
+                acquired = to_datetime(seconds)
+                writer.writerow([index.basenames[row], acquired.strftime('%y-%m-%d'), acquired.strftime('%H:%M:%S')])
+
+def well_hours(index, mask, times, wells, timepoints, reference):
+    '''
+    Start of each well at each timepoint (its first logged image).
+    Returns (elapsed hours since reference seconds as a Well x Timepoint array
+    with NaN where nothing was logged, start seconds array, first image row array).
+    '''
+    rows = np.flatnonzero(mask)
+    logged = times >= 0
+    w = index.axis_positions('Well', wells)[rows]
+    t = index.axis_positions('Timepoint', timepoints)[rows]
+    keep = logged & (w >= 0) & (t >= 0)
+
+    starts = np.full((len(wells), len(timepoints)), np.iinfo(np.int64).max, dtype=np.int64)
+    np.minimum.at(starts, (w[keep], t[keep]), times[keep])
+    first_rows = np.full(starts.shape, -1, dtype=np.int64)
+    is_first = keep.copy()
+    is_first[keep] = times[keep] == starts[w[keep], t[keep]]
+    # rows are in crawl order; the last write wins, so write in reverse to keep the first
+    for i in np.flatnonzero(is_first)[::-1]:
+        first_rows[w[i], t[i]] = rows[i]
+
+    has_start = first_rows >= 0
+    elapsed = np.where(has_start, np.round((starts - reference) / 3600.0, 1), np.nan)
+    return elapsed, starts, first_rows
@@ -0,0 +1,88 @@
+'''
+Persistent crawl manifest for repeat runs on the same experiment.
+The manifest stores the listing (with file sizes), mtime and scan time of every crawled directory
+plus the parsed file index. On the next run only directories whose
+mtime changed, or changed too close to the last scan to be trusted, are
+listed again; if none changed the index is reused as is.
+'''
+
+import os, pickle
+
+import crawler
+import file_index
+import run_stats
+
+MANIFEST_NAME = 'crawl_manifest.p'
+# bump when the FileIndex layout or manifest contents change
+MANIFEST_VERSION = 4
+
+
+def load_manifest(manifest_path, input_path, robo_num):
+    '''Return the stored manifest, or None if missing or stale.'''
+    if not os.path.exists(manifest_path):
+        return None
+    try:
+        with open(manifest_path, 'rb') as f:
+            manifest = pickle.load(f)
+    except (pickle.UnpicklingError, EOFError, AttributeError, ImportError) as e:
+        print('Ignoring unreadable crawl manifest (%s): %s' % (manifest_path, e))
+        return None
+    if manifest.get('Version') != MANIFEST_VERSION:
+        print('Crawl manifest was written by another version; rescanning.')
+        return None
+    if manifest.get('InputPath') != input_path:
+        print('Crawl manifest is for another input path (%s); rescanning.' % manifest.get('InputPath'))
+        return None
+    if manifest.get('RoboNumber') != robo_num:
+        print('Token standard changed (Robo %s -> Robo %s); rescanning.' % (manifest.get('RoboNumber'), robo_num))
+        return None
+    return manifest
+
+def save_manifest(manifest_path, manifest):
+    '''Write the manifest atomically so an interrupted run never leaves a partial file.'''
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(manifest, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, manifest_path)
+
+def crawl_cached(input_path, dir_structure, robo_num, cache_dir, rescan=False,
+        workers=crawler.DEFAULT_WORKERS, stats=None):
+    '''
+    Crawl input_path into a FileIndex, reusing the manifest in cache_dir where possible.
+    Only the sub_dir layout is cached; root_dir is always crawled in full.
+    Crawl and tokenization are recorded as separate stages in stats.
+    '''
+    stats = stats or run_stats.RunStats()
+    index = file_index.FileIndex()
+    if dir_structure != 'sub_dir':
+        import utils
+        with stats.stage('crawl') as counters:
+            all_files = utils.get_all_files_all_subdir(input_path)
+            counters['FilesSeen'] = len(all_files)
+        with stats.stage('tokenization') as counters:
+            index.extend(all_files)
+            counters['Files'] = len(index)
+        return index
+
+    manifest_path = os.path.join(cache_dir, MANIFEST_NAME)
+    with stats.stage('crawl') as counters:
+        manifest = None if rescan else load_manifest(manifest_path, input_path, robo_num)
+        cached_dirs = manifest['Dirs'] if manifest else {}
+        dirs, num_relisted = crawler.crawl_sub_dir(input_path, None, workers, cached_dirs)
+        counters['ManifestUsed'] = manifest is not None
+        counters['Directories'] = len(dirs)
+        counters['DirectoriesListed'] = num_relisted
+        counters['FilesSeen'] = sum(len(listing[1]) for listing in dirs.values())
+    if manifest and num_relisted == 0 and list(dirs) == list(cached_dirs):
+        print('Crawl manifest up to date: reusing index of %d files.' % len(manifest['Index']))
+        return manifest['Index']
+    print('Listed %d of %d directories.' % (num_relisted, len(dirs)))
+
+    with stats.stage('tokenization') as counters:
+        for dir_path, (mtime, images, subdirs, sizes, scanned) in dirs.items():
+            crawler.add_listing(index, dir_path, images, sizes)
+        counters['Files'] = len(index)
+    with stats.stage('manifest_output'):
+        save_manifest(manifest_path, {'Version': MANIFEST_VERSION, 'InputPath': input_path,
+            'RoboNumber': robo_num, 'Dirs': dirs, 'Index': index})
+    return index
@@ -0,0 +1,53 @@
+'''
+Per-stage timing and counters for a Create_Folders_And_Check_Data run.
+Each stage records wall time, peak resident memory so far and any
+counters the stage adds; the whole run is written as a JSON sidecar so
+runs can be aggregated to find slow storage or pathological plates.
+'''
+
+import json, time, datetime
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def peak_rss_mb():
+    '''Peak resident set size of this process in MB (None where unavailable).'''
+    if resource is None:
+        return None
+    # ru_maxrss is in KB on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1)
+
+
+class RunStats(object):
+    '''Ordered list of timed stages with their counters.'''
+
+    def __init__(self):
+        self.started = datetime.datetime.utcnow()
+        self.start_time = time.perf_counter()
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name):
+        '''Time a block; yields a dict the block can fill with counters.'''
+        counters = {}
+        start = time.perf_counter()
+        try:
+            yield counters
+        finally:
+            self.stages.append({'Stage': name, 'Seconds': round(time.perf_counter() - start, 6),
+                'PeakRSSMB': peak_rss_mb(), 'Counters': counters})
+
+    def elapsed(self):
+        return datetime.timedelta(seconds=time.perf_counter() - self.start_time)
+
+    def write_json(self, path, **fields):
+        '''Write the stages, total run time and any extra fields (e.g. Status) to path.'''
+        record = {'Started': self.started.isoformat(), 'TotalSeconds': round(self.elapsed().total_seconds(), 6),
+            'PeakRSSMB': peak_rss_mb(), 'Stages': self.stages}
+        record.update(fields)
+        with open(path, 'w') as f:
+            json.dump(record, f, indent=2)
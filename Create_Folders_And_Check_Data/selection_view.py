@@ -0,0 +1,128 @@
+'''
+Materialized view of the selected images.
+Links every selected image into a small per-well (or per-well/timepoint)
+tree under the output folder, so later steps and ad-hoc scripts list a
+few pre-partitioned folders instead of globbing the whole raw plate.
+Links are hardlinks where the raw data is on the same filesystem and
+symlinks otherwise, created and removed on a thread pool. The links of
+the previous run are remembered in the view folder, so a re-run with a
+different selection only adds and removes the links that changed. A
+hardlink whose raw file was since replaced (e.g. re-synced through a
+temporary file and a rename) still holds the old data, so it is relinked.
+'''
+
+import os, errno, pickle, stat
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+VIEW_DIR = 'SelectedImages'
+VIEW_BY = ['well', 'well_timepoint']
+VIEW_MANIFEST = '.selection_view.p'
+# DirStructure of the view for each VIEW_BY: one folder per well, or per well then timepoint
+VIEW_DIR_STRUCTURE = {'well': 'sub_dir', 'well_timepoint': 'well_timepoint_dir'}
+DEFAULT_WORKERS = 32
+# link errors that mean a hardlink is not possible here, so a symlink is made instead
+HARDLINK_ERRORS = (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.EACCES, errno.ENOTSUP)
+
+
+def view_prefixes(index, mask, view_path, view_by='well'):
+    '''
+    Folder of each selected file in the view.
+    Returns (view folder prefixes, prefix code per index row, -1 if not selected).
+    '''
+    assert view_by in VIEW_BY, 'The view must be made by one of: %s' % ', '.join(VIEW_BY)
+    rows = np.flatnonzero(mask)
+    wells = np.array(index.values('Well') + [''], dtype=object)[index.codes('Well')[rows]]
+    if view_by == 'well_timepoint':
+        timepoints = np.array(index.values('Timepoint') + [''], dtype=object)[index.codes('Timepoint')[rows]]
+        folders = [os.path.join(view_path, well, tp, '') for well, tp in zip(wells, timepoints)]
+    else:
+        folders = [os.path.join(view_path, well, '') for well in wells]
+    lookup = {}
+    prefix_codes = np.full(len(index), -1, dtype=np.int32)
+    prefix_codes[rows] = [lookup.setdefault(folder, len(lookup)) for folder in folders]
+    prefixes = sorted(lookup, key=lookup.get)
+    return prefixes, prefix_codes
+
+def make_link(source, link):
+    '''Hardlink source to link, or symlink it if a hardlink is not possible. Returns True for a symlink.'''
+    try:
+        os.link(source, link)
+        return False
+    except OSError as e:
+        if e.errno not in HARDLINK_ERRORS:
+            raise
+    os.symlink(source, link)
+    return True
+
+def is_current(link, source):
+    '''True if link still shows the file now at source: a symlink to it, or a hardlink to the same inode.'''
+    try:
+        link_stat = os.lstat(link)
+        if stat.S_ISLNK(link_stat.st_mode):
+            return os.readlink(link) == source
+        source_stat = os.stat(source)
+    except OSError:
+        return False
+    return (link_stat.st_dev, link_stat.st_ino) == (source_stat.st_dev, source_stat.st_ino)
+
+def remove_link(link):
+    try:
+        os.unlink(link)
+    except FileNotFoundError:
+        pass
+
+def materialize_view(index, mask, view_path, view_by='well', workers=DEFAULT_WORKERS):
+    '''
+    Link the selected files into view_path and remove links of files no longer selected.
+    Returns (view folder prefixes, prefix code per index row, counts of links
+    added, removed, kept, refreshed because their raw file was replaced, and made as symlinks).
+    '''
+    prefixes, prefix_codes = view_prefixes(index, mask, view_path, view_by)
+    rows = np.flatnonzero(mask)
+    links = {}
+    for row in rows:
+        link = prefixes[prefix_codes[row]] + index.basenames[row]
+        source = index.path(row)
+        if links.setdefault(link, source) != source:
+            raise ValueError('Selected images %s and %s would share the view path %s' % (links[link], source, link))
+
+    manifest_path = os.path.join(view_path, VIEW_MANIFEST)
+    previous = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'rb') as f:
+            previous = pickle.load(f)
+    # the view folders are small, so listing them is cheaper than a stat per link
+    existing = set()
+    for prefix in prefixes:
+        if os.path.isdir(prefix):
+            existing.update(os.path.join(prefix, name) for name in os.listdir(prefix))
+        else:
+            os.makedirs(prefix)
+    unchanged = [link for link, source in links.items() if previous.get(link) == source and link in existing]
+    stale = [link for link, source in previous.items() if links.get(link) != source]
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        current = set(link for link, ok in zip(unchanged,
+            executor.map(lambda link: is_current(link, links[link]), unchanged)) if ok)
+        new = [link for link in links if link not in current]
+        # files in the way of a new link: outdated links and files the manifest does not know
+        stale_links = set(stale)
+        replaced = [link for link in new if link in existing and link not in stale_links]
+        list(executor.map(remove_link, stale + replaced))
+        symlinks = sum(executor.map(lambda link: make_link(links[link], link), new))
+
+    # drop folders left empty by removed links
+    for folder in sorted(set(os.path.dirname(link) for link in stale), reverse=True):
+        while folder != view_path and os.path.isdir(folder) and not os.listdir(folder):
+            os.rmdir(folder)
+            folder = os.path.dirname(folder)
+
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(links, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, manifest_path)
+    counts = {'Added': len(new), 'Removed': len(stale), 'Kept': len(current),
+        'Refreshed': len(unchanged) - len(current), 'Symlinks': symlinks}
+    return prefixes, prefix_codes, counts
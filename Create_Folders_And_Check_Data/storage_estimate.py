@@ -0,0 +1,107 @@
+'''
+Storage footprint estimate for the output folders.
+Projects the bytes each downstream step will write from the size of the
+selected tiles (stat-ed during the crawl), the tile dimensions, the panel
+grid and its pixel overlap, and the number of selected
+wells/timepoints/channels, then compares the total with the free space
+of the output volume so a run can warn, or optionally fail, before the
+montage fills it up. Estimates are upper bounds for uncompressed output,
+so the default is to warn.
+'''
+
+import os, shutil, struct
+
+import numpy as np
+
+import tiff_check
+
+DISK_CHECK = ['fail', 'warn', 'off']
+# stage folder, what it holds, bytes relative to a montage of the same bit depth as the tiles
+# tile: one image per selected tile; montage: one stitched image per well/timepoint/channel;
+# morphology: one stitched image per well/timepoint of the morphology channel
+STAGE_OUTPUTS = [
+    ('BackgroundCorrected', 'tile', 1.0),
+    ('MontagedImages', 'montage', 1.0),
+    ('AlignedImages', 'montage', 1.0),
+    ('CroppedImages', 'montage', 1.0),
+    ('CellMasks', 'morphology', 1.0),
+    # 8-bit RGB visualizations of a 16-bit montage
+    ('QualityControl', 'morphology', 1.5),
+    ('OverlaysTablesResults', 'morphology', 1.5),
+]
+SAMPLE_FILES = 100
+
+
+def tile_sizes(index, mask):
+    '''Sizes of the selected files; files the crawl did not stat are estimated from a sample of them.'''
+    sizes = index.file_sizes(mask)
+    unknown = np.flatnonzero(sizes < 0)
+    if len(unknown):
+        rows = np.flatnonzero(mask)[unknown]
+        sample = [os.path.getsize(index.path(row)) for row in rows[:SAMPLE_FILES]]
+        sizes[unknown[:len(sample)]] = sample
+        sizes[unknown[len(sample):]] = int(np.median(sample))
+    return sizes
+
+def tile_dimensions(path, tile_bytes, bytes_per_pixel=2):
+    '''(width, height) of a tile from its TIFF header, or a square guess from its size.'''
+    try:
+        header = tiff_check.read_tiff_header(path)
+        return header['Width'], header['Height']
+    except (OSError, tiff_check.TiffHeaderError, struct.error):
+        side = max(1, int(np.sqrt(tile_bytes / bytes_per_pixel)))
+        return side, side
+
+def estimate_output_bytes(var_dict, index, mask):
+    '''
+    Projected bytes per output folder for the selected files.
+    Returns dict with TileBytes, TileWidth, TileHeight, MontageBytes,
+    Stages ({folder: bytes}) and TotalBytes.
+    '''
+    sizes = tile_sizes(index, mask)
+    tile_bytes = int(np.median(sizes)) if len(sizes) else 0
+    rows = np.flatnonzero(mask)
+    width, height = tile_dimensions(index.path(rows[0]), tile_bytes) if len(rows) else (0, 0)
+
+    # stitched size with the panel overlap removed between neighbouring tiles
+    num_horizontal = var_dict['NumberHorizontalImages']
+    num_vertical = var_dict['NumberVerticalImages']
+    overlap = var_dict['ImagePixelOverlap']
+    montage_pixels = max(0, num_horizontal * width - (num_horizontal - 1) * overlap) * \
+        max(0, num_vertical * height - (num_vertical - 1) * overlap)
+    montage_bytes = tile_bytes * montage_pixels / float(max(1, width * height))
+
+    # one montage per panel grid of selected tiles, which also covers depths and bursts
+    num_panels = num_horizontal * num_vertical
+    num_montages = len(rows) / float(num_panels)
+    morphology = index.select(Channel=[var_dict['MorphologyChannel']]) & mask
+    num_morphology = morphology.sum() / float(num_panels)
+    kind_bytes = {'tile': sizes.sum(), 'montage': num_montages * montage_bytes,
+        'morphology': num_morphology * montage_bytes}
+
+    stages = dict((stage, int(kind_bytes[kind] * factor)) for stage, kind, factor in STAGE_OUTPUTS)
+    return {'TileBytes': tile_bytes, 'TileWidth': width, 'TileHeight': height,
+        'MontageBytes': int(montage_bytes), 'Stages': stages, 'TotalBytes': sum(stages.values())}
+
+def format_bytes(num_bytes):
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if abs(num_bytes) < 1024:
+            return '%.1f %s' % (num_bytes, unit)
+        num_bytes /= 1024.0
+    return '%.1f TB' % num_bytes
+
+def check_free_space(estimate, output_path, mode='warn'):
+    '''
+    Compare the estimated total with the free space at output_path.
+    Raises ValueError with mode fail, prints a warning with mode warn.
+    Returns the free bytes.
+    '''
+    free = shutil.disk_usage(output_path).free
+    if mode != 'off' and estimate['TotalBytes'] > free:
+        message = 'Estimated output (%s) exceeds the free space at %s (%s):\n\n%s' % (
+            format_bytes(estimate['TotalBytes']), output_path, format_bytes(free),
+            '\n'.join('%s: %s' % (stage, format_bytes(estimate['Stages'][stage])) for stage, kind, factor in STAGE_OUTPUTS))
+        if mode == 'fail':
+            raise ValueError(message)
+        print('Warning: ' + message)
+    return free
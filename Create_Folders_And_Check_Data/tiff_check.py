@@ -0,0 +1,134 @@
+'''
+Header-level TIFF integrity scan.
+Reads only the TIFF header and first IFD of each image (no pixel
+decoding) on a thread pool sized for network storage, and flags
+zero-byte or truncated files, non-TIFF files, unexpected dimensions,
+unexpected bit depth and strips that do not fit the image or the file.
+'''
+
+import os, struct
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_WORKERS = 32
+
+IMAGE_WIDTH = 256
+IMAGE_LENGTH = 257
+BITS_PER_SAMPLE = 258
+COMPRESSION = 259
+STRIP_OFFSETS = 273
+SAMPLES_PER_PIXEL = 277
+STRIP_BYTE_COUNTS = 279
+TILE_OFFSETS = 324
+TILE_BYTE_COUNTS = 325
+
+# TIFF field type -> (struct code, size in bytes) for the integer types used by these tags
+FIELD_TYPES = {1: ('B', 1), 3: ('H', 2), 4: ('I', 4), 16: ('Q', 8)}
+
+
+class TiffHeaderError(Exception):
+    '''The file is not a readable TIFF.'''
+
+
+def _read_exact(f, offset, size):
+    f.seek(offset)
+    data = f.read(size)
+    if len(data) != size:
+        raise TiffHeaderError('truncated TIFF header')
+    return data
+
+def read_tiff_header(path):
+    '''
+    Parse the first IFD of a classic or Big TIFF.
+    Returns dict with Width, Height, BitsPerSample, SamplesPerPixel,
+    Compression, DataBytes (sum of strip/tile byte counts) and DataEnd
+    (largest strip/tile offset + byte count).
+    '''
+    with open(path, 'rb') as f:
+        head = f.read(16)
+        if head[:2] == b'II':
+            order = '<'
+        elif head[:2] == b'MM':
+            order = '>'
+        else:
+            raise TiffHeaderError('not a TIFF file')
+        if len(head) < 8:
+            raise TiffHeaderError('truncated TIFF header')
+        version = struct.unpack(order + 'H', head[2:4])[0]
+        if version == 42:
+            ifd_offset = struct.unpack(order + 'I', head[4:8])[0]
+            count_format, entry_format, entry_size, value_size = 'H', 'HHI4s', 12, 4
+        elif version == 43 and len(head) == 16:
+            ifd_offset = struct.unpack(order + 'Q', head[8:16])[0]
+            count_format, entry_format, entry_size, value_size = 'Q', 'HHQ8s', 20, 8
+        else:
+            raise TiffHeaderError('unsupported TIFF version %d' % version)
+
+        count_size = struct.calcsize(count_format)
+        num_entries = struct.unpack(order + count_format, _read_exact(f, ifd_offset, count_size))[0]
+        entries = _read_exact(f, ifd_offset + count_size, num_entries * entry_size)
+
+        tags = {}
+        for i in range(num_entries):
+            tag, field_type, count, value = struct.unpack(order + entry_format, entries[i * entry_size:(i + 1) * entry_size])
+            if field_type not in FIELD_TYPES:
+                continue
+            code, size = FIELD_TYPES[field_type]
+            if count * size <= value_size:
+                data = value[:count * size]
+            else:
+                data = _read_exact(f, struct.unpack(order + ('I' if value_size == 4 else 'Q'), value)[0], count * size)
+            tags[tag] = struct.unpack(order + code * count, data)
+
+    if IMAGE_WIDTH not in tags or IMAGE_LENGTH not in tags:
+        raise TiffHeaderError('missing image dimensions')
+    offsets = tags.get(STRIP_OFFSETS, tags.get(TILE_OFFSETS, ()))
+    byte_counts = tags.get(STRIP_BYTE_COUNTS, tags.get(TILE_BYTE_COUNTS, ()))
+    return {
+        'Width': tags[IMAGE_WIDTH][0],
+        'Height': tags[IMAGE_LENGTH][0],
+        'BitsPerSample': tags.get(BITS_PER_SAMPLE, (1,))[0],
+        'SamplesPerPixel': tags.get(SAMPLES_PER_PIXEL, (1,))[0],
+        'Compression': tags.get(COMPRESSION, (1,))[0],
+        'DataBytes': sum(byte_counts),
+        'DataEnd': max([offset + count for offset, count in zip(offsets, byte_counts)] or [0]),
+    }
+
+def scan_file(path):
+    '''Return (file size, header dict or None, problem or None) for one file.'''
+    try:
+        size = os.path.getsize(path)
+        if size == 0:
+            return size, None, 'zero-byte file'
+        return size, read_tiff_header(path), None
+    except (OSError, TiffHeaderError, struct.error) as e:
+        return None, None, str(e)
+
+def check_tiff_headers(paths, bits_per_sample=16, workers=DEFAULT_WORKERS):
+    '''
+    Scan the headers of all paths and return [(path, problem)] for the bad ones.
+    Expected dimensions are the most common ones in the dataset.
+    '''
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        results = list(executor.map(scan_file, paths))
+
+    dimensions = Counter((header['Width'], header['Height']) for size, header, problem in results if header)
+    expected_dimensions = dimensions.most_common(1)[0][0] if dimensions else None
+
+    problems = []
+    for path, (size, header, problem) in zip(paths, results):
+        if problem is not None:
+            problems.append((path, problem))
+            continue
+        if (header['Width'], header['Height']) != expected_dimensions:
+            problems.append((path, 'dimensions %dx%d, expected %dx%d' % (
+                header['Width'], header['Height'], expected_dimensions[0], expected_dimensions[1])))
+        if header['BitsPerSample'] != bits_per_sample:
+            problems.append((path, '%d-bit image, expected %d-bit' % (header['BitsPerSample'], bits_per_sample)))
+        if header['DataEnd'] > size:
+            problems.append((path, 'truncated: file is %d bytes, image data ends at byte %d' % (size, header['DataEnd'])))
+        elif header['Compression'] == 1:
+            expected_bytes = header['Width'] * header['Height'] * header['SamplesPerPixel'] * header['BitsPerSample'] // 8
+            if header['DataBytes'] < expected_bytes:
+                problems.append((path, 'image data is %d bytes, expected %d' % (header['DataBytes'], expected_bytes)))
+    return problems
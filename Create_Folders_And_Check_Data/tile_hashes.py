@@ -0,0 +1,70 @@
+'''
+Content hashing of duplicated tiles.
+Tells byte-identical copies (e.g. from a re-sync) apart from genuine
+re-acquisitions. Each file is first hashed from a cheap sample (its
+size, header and a few strided blocks) on a thread pool; only files
+whose sample matches another file's are read in full, so distinct
+re-acquisitions usually cost a few small reads each.
+'''
+
+import os, hashlib
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_WORKERS = 32
+SAMPLE_BLOCK_BYTES = 64 * 1024
+SAMPLE_BLOCKS = 4
+FULL_HASH_CHUNK_BYTES = 1024 * 1024
+
+
+def sample_hash(path):
+    '''Hash of the file size, the first block and SAMPLE_BLOCKS blocks strided over the rest.'''
+    size = os.path.getsize(path)
+    digest = hashlib.blake2b(str(size).encode('ascii'), digest_size=16)
+    with open(path, 'rb') as f:
+        digest.update(f.read(SAMPLE_BLOCK_BYTES))
+        if size > SAMPLE_BLOCK_BYTES:
+            stride = (size - SAMPLE_BLOCK_BYTES) // SAMPLE_BLOCKS
+            for i in range(1, SAMPLE_BLOCKS + 1):
+                f.seek(min(SAMPLE_BLOCK_BYTES + i * stride, size) - SAMPLE_BLOCK_BYTES)
+                digest.update(f.read(SAMPLE_BLOCK_BYTES))
+    return size, digest.hexdigest()
+
+def full_hash(path):
+    '''Hash of the whole file, read in chunks.'''
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(FULL_HASH_CHUNK_BYTES), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def hash_files(paths, workers=DEFAULT_WORKERS):
+    '''
+    Hash paths, escalating to a full hash only for files whose sample hash
+    matches another file's. Returns [(size, hash, 'sample' or 'full')] in path order;
+    files with equal full hashes are identical copies.
+    '''
+    paths = list(paths)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        samples = list(executor.map(sample_hash, paths))
+        same_sample = defaultdict(list)
+        for i, sample in enumerate(samples):
+            same_sample[sample].append(i)
+        to_check = [i for group in same_sample.values() if len(group) > 1 for i in group]
+        full_hashes = dict(zip(to_check, executor.map(full_hash, [paths[i] for i in to_check])))
+    hashes = []
+    for i, (size, digest) in enumerate(samples):
+        if i in full_hashes:
+            hashes.append((size, full_hashes[i], 'full'))
+        else:
+            hashes.append((size, digest, 'sample'))
+    return hashes
+
+def identical_sets(hashes):
+    '''Set number per file: files share a number only if their full hashes match.'''
+    set_numbers = {}
+    numbers = []
+    for i, (size, digest, kind) in enumerate(hashes):
+        key = (size, digest) if kind == 'full' else ('sample', i)
+        numbers.append(set_numbers.setdefault(key, len(set_numbers)))
+    return numbers
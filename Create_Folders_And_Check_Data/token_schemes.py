@@ -0,0 +1,110 @@
+'''
+Registry of the filename naming schemes understood by the pipeline.
+Each scheme is a row of SCHEMES: its name, Robo number, light path and
+the fields of its underscore-separated tokens. The token patterns are
+compiled into one alternation, so every filename of a dataset is
+classified in a single regex pass, and the column layout of the file
+index comes from the same table.
+
+    Robo3: PIDdate_ExptName_Timepoint_Hours_Well_MontageNumber_Channel.tif
+    Robo4 epi: PIDdate_ExptName_Timepoint_Hours_Well_MontageNumber_Channel_FilterDet_Camera.tif
+    Robo4 confocal: PIDdate_ExptName_Timepoint_Hours_Well_MontageNumber_FilterDet1_FilterDet2_[FilterDet3]_Channel_DepthIndex_DepthIncrement_Camera.tif
+    Robo0: PIDdate_ExptName_Timepoint_Hours-BurstIndex_Well_MontageNumber_Channel_TimeIncrement_DepthIndex_DepthIncrement.tif
+    IXM: PlateName_Well_sSite_wWavelength.tif (ImageXpress; recognized, not processed)
+'''
+
+import os, re
+from collections import Counter
+from functools import lru_cache
+
+import numpy as np
+
+# Robo number 1 asks for the scheme to be detected from the filenames
+AUTO_DETECT = 1
+UNRECOGNIZED = 'unrecognized'
+
+# Pattern of each field; fields not listed match any token
+FIELD_PATTERNS = {
+    'Timepoint': r'T\d+',
+    'Well': r'[A-Z]{1,2}\d{1,2}',
+    'Panel': r'\d+',
+    'BurstHours': r'[^_\n]+-\d+',
+    'Site': r's\d+',
+    'Wavelength': r'w\d[^_\n]*',
+}
+ANY_TOKEN = r'[^_\n]+'
+
+ROBO_HEAD = ['PlateID', 'ExptName', 'Timepoint', 'Hours', 'Well', 'Panel']
+
+# name, Robo number, light path, fields in token order
+SCHEMES = [
+    ('Robo3', 3, 'epi', ROBO_HEAD + ['Channel']),
+    ('Robo0', 0, 'epi', ROBO_HEAD[:3] + ['BurstHours'] + ROBO_HEAD[4:] + ['Channel', 'TimeIncrement', 'Depth', 'DepthIncrement']),
+    ('Robo4 epi', 4, 'epi', ROBO_HEAD + ['Channel', 'FilterDet', 'Camera']),
+    ('Robo4 confocal', 4, 'confocal', ROBO_HEAD + ['FilterDet1', 'FilterDet2', 'Channel', 'Depth', 'DepthIncrement', 'Camera']),
+    ('Robo4 confocal', 4, 'confocal', ROBO_HEAD + ['FilterDet1', 'FilterDet2', 'FilterDet3', 'Channel', 'Depth', 'DepthIncrement', 'Camera']),
+    ('IXM', None, None, ['PlateID', 'Well', 'Site', 'Wavelength']),
+]
+
+# Derived column holding the burst index from the Robo0 Hours-BurstIndex token
+BURST = 'Burst'
+
+
+def scheme_pattern(fields):
+    '''Regex for a name whose underscore-separated tokens are the given fields.'''
+    return '_'.join('(?:%s)' % FIELD_PATTERNS.get(field, ANY_TOKEN) for field in fields)
+
+def get_layout(scheme):
+    '''Map column names to token positions for one row of SCHEMES.'''
+    name, robo_num, light_path, fields = scheme
+    layout = {}
+    for position, field in enumerate(fields):
+        if field == 'BurstHours':
+            layout['Hours'] = position
+            layout['Burst'] = BURST
+        else:
+            layout[field] = position
+    return layout
+
+def get_schemes(robo_num=AUTO_DETECT):
+    '''Indices into SCHEMES that may occur for a Robo number (all of them when auto-detecting).'''
+    return [i for i, scheme in enumerate(SCHEMES) if robo_num == AUTO_DETECT or scheme[1] == robo_num]
+
+@lru_cache(maxsize=None)
+def compile_schemes(schemes):
+    '''One multi-line alternation with a group per scheme and a catch-all for unrecognized names.'''
+    alternatives = ['(?P<s%d>%s)' % (i, scheme_pattern(SCHEMES[i][3])) for i in schemes]
+    return re.compile(r'^(?:%s|(?P<unrecognized>[^\n]*))$' % '|'.join(alternatives), re.M)
+
+def classify(basenames, schemes=None):
+    '''
+    Classify filenames against the given schemes in a single regex pass.
+    Returns the index into SCHEMES of each filename, or -1 if none matches.
+    '''
+    schemes = range(len(SCHEMES)) if schemes is None else schemes
+    pattern = compile_schemes(tuple(schemes))
+    scheme_of_group = dict(('s%d' % i, i) for i in schemes)
+    scheme_of_group[UNRECOGNIZED] = -1
+    stems = '\n'.join(os.path.splitext(name)[0] for name in basenames)
+    return np.array([scheme_of_group[match.lastgroup] for match in pattern.finditer(stems)],
+        dtype=np.int32)[:len(basenames)]
+
+def scheme_names(scheme_codes):
+    '''Scheme name of each classified file (unrecognized for -1).'''
+    return np.array([scheme[0] for scheme in SCHEMES] + [UNRECOGNIZED], dtype=object)[scheme_codes]
+
+def count_schemes(scheme_codes):
+    '''[(scheme name, number of files)], most common first.'''
+    return Counter(scheme_names(scheme_codes)).most_common()
+
+def dominant_scheme(scheme_codes, schemes):
+    '''
+    Name of the scheme among the given ones that most files follow (None if
+    no file follows any of them), and the boolean mask of those files.
+    '''
+    names = scheme_names(scheme_codes)
+    counts = Counter(names[np.isin(scheme_codes, schemes)])
+    if not counts:
+        return None, np.zeros(len(names), dtype=bool)
+    name = counts.most_common(1)[0][0]
+    return name, names == name
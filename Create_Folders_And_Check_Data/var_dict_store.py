@@ -0,0 +1,178 @@
+'''
+Compact, lazily loadable alternative to the pickled var_dict.
+
+Layout of a compact var_dict file:
+    MAGIC
+    8-byte little-endian header length
+    JSON header: scalar var_dict entries, directory prefixes, token values
+        per column and the dtype/shape/offset of every array
+    64-byte aligned raw arrays (memory-mappable with numpy.memmap)
+
+AnalyzedFiles is stored as a file table sorted by Well then Timepoint
+(directory-prefix codes, basename blob, integer-coded tokens), with a
+Well x Timepoint offset table so a downstream step can map just the rows
+of its own well. load_var_dict returns a read-only mapping that behaves
+like the unpickled dict for existing consumers.
+'''
+
+import json, pickle, struct
+from collections.abc import Mapping
+
+import numpy as np
+
+import file_index
+
+MAGIC = b'CFCVARDICT1\n'
+ALIGNMENT = 64
+FILE_COLUMNS = ['Well', 'Timepoint', 'Channel', 'Panel']
+
+
+def _aligned(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+def write_compact(var_dict, index, mask, path):
+    '''Write var_dict with AnalyzedFiles taken from the masked rows of the file index.'''
+    wells = list(var_dict['Wells'])
+    timepoints = list(var_dict['TimePoints'])
+
+    # stable sort of the rows into contiguous well/timepoint groups
+    order, rows, row_wells, row_tps = file_index.well_timepoint_order(index, mask, wells, timepoints)
+    group_keys = row_wells * len(timepoints) + row_tps
+    group_offsets = np.searchsorted(group_keys, np.arange(len(wells) * len(timepoints) + 1)).astype(np.int64)
+
+    names = [index.basenames[row].encode('utf-8') for row in rows]
+    name_offsets = np.zeros(len(names) + 1, dtype=np.int64)
+    np.cumsum([len(name) for name in names], out=name_offsets[1:])
+    arrays = {
+        'PrefixCodes': np.array(index.prefix_codes, dtype=np.int32)[rows],
+        'NameOffsets': name_offsets,
+        'Names': np.frombuffer(b''.join(names), dtype=np.uint8),
+        'GroupOffsets': group_offsets,
+        # stored position of each AnalyzedFiles entry, to restore the original order
+        'CrawlOrder': np.argsort(order).astype(np.int64),
+    }
+    columns = {}
+    for name in FILE_COLUMNS:
+        arrays[name] = index.codes(name)[rows]
+        columns[name] = index.values(name)
+
+    header = {
+        'Scalars': dict((key, value) for key, value in var_dict.items() if key != 'AnalyzedFiles'),
+        'Prefixes': index.prefixes,
+        'Columns': columns,
+        'Arrays': {},
+    }
+    # header size depends on the offsets it records, so reserve room for them first
+    for name, values in arrays.items():
+        header['Arrays'][name] = {'dtype': values.dtype.str, 'shape': list(values.shape), 'offset': 0}
+    header_size = len(json.dumps(header).encode('utf-8')) + 32 * len(arrays)
+    offset = _aligned(len(MAGIC) + 8 + header_size)
+    for name, values in arrays.items():
+        header['Arrays'][name]['offset'] = offset
+        offset = _aligned(offset + values.nbytes)
+    header_bytes = json.dumps(header).encode('utf-8').ljust(header_size)
+
+    with open(path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(header_bytes)))
+        f.write(header_bytes)
+        for name, values in arrays.items():
+            f.seek(header['Arrays'][name]['offset'])
+            f.write(np.ascontiguousarray(values).tobytes())
+        f.truncate(offset)
+
+
+class CompactVarDict(Mapping):
+    '''
+    Read-only, dict-compatible view of a compact var_dict file.
+    Scalars come from the JSON header; the file table is memory-mapped
+    and AnalyzedFiles is only built when first asked for.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            assert f.read(len(MAGIC)) == MAGIC, 'Not a compact var_dict file: %s' % path
+            header_size = struct.unpack('<Q', f.read(8))[0]
+            header = json.loads(f.read(header_size).decode('utf-8'))
+        self._scalars = header['Scalars']
+        self.prefixes = header['Prefixes']
+        self.columns = header['Columns']
+        self._array_specs = header['Arrays']
+        self._arrays = {}
+        self._analyzed_files = None
+        self._well_pos = dict((well, i) for i, well in enumerate(self._scalars['Wells']))
+        self._tp_pos = dict((tp, i) for i, tp in enumerate(self._scalars['TimePoints']))
+
+    def array(self, name):
+        '''Memory-mapped array from the file table.'''
+        if name not in self._arrays:
+            spec = self._array_specs[name]
+            if spec['shape'][0] == 0:
+                self._arrays[name] = np.zeros(spec['shape'], dtype=spec['dtype'])
+            else:
+                self._arrays[name] = np.memmap(self.path, dtype=spec['dtype'], mode='r',
+                    offset=spec['offset'], shape=tuple(spec['shape']))
+        return self._arrays[name]
+
+    def _rows(self, well=None, timepoint=None):
+        offsets = self.array('GroupOffsets')
+        num_timepoints = len(self._tp_pos)
+        if well is None and timepoint is None:
+            return range(int(offsets[-1]))
+        if timepoint is None:
+            w = self._well_pos[well]
+            return range(int(offsets[w * num_timepoints]), int(offsets[(w + 1) * num_timepoints]))
+        if well is None:
+            t = self._tp_pos[timepoint]
+            groups = range(t, len(offsets) - 1, num_timepoints)
+            return [row for g in groups for row in range(int(offsets[g]), int(offsets[g + 1]))]
+        g = self._well_pos[well] * num_timepoints + self._tp_pos[timepoint]
+        return range(int(offsets[g]), int(offsets[g + 1]))
+
+    def _path(self, row, prefix_codes, name_offsets, names):
+        name = bytes(names[name_offsets[row]:name_offsets[row + 1]]).decode('utf-8')
+        return self.prefixes[prefix_codes[row]] + name
+
+    def files(self, well=None, timepoint=None):
+        '''Paths of the analyzed files for one well and/or timepoint, without loading the others.'''
+        prefix_codes = self.array('PrefixCodes')
+        name_offsets = self.array('NameOffsets')
+        names = self.array('Names')
+        return [self._path(row, prefix_codes, name_offsets, names) for row in self._rows(well, timepoint)]
+
+    def tokens(self, name, well=None, timepoint=None):
+        '''Token values of a file-table column (Well, Timepoint, Channel, Panel) for the selected rows.'''
+        codes = self.array(name)
+        values = self.columns[name]
+        return [values[codes[row]] for row in self._rows(well, timepoint)]
+
+    def __getitem__(self, key):
+        if key == 'AnalyzedFiles':
+            if self._analyzed_files is None:
+                stored = self.files()
+                self._analyzed_files = [stored[row] for row in self.array('CrawlOrder')]
+            return self._analyzed_files
+        return self._scalars[key]
+
+    def __iter__(self):
+        for key in self._scalars:
+            yield key
+        yield 'AnalyzedFiles'
+
+    def __len__(self):
+        return len(self._scalars) + 1
+
+    def to_dict(self):
+        '''Fully materialized plain dict, identical to the pickled var_dict.'''
+        return dict(self.items())
+
+
+def load_var_dict(path):
+    '''Load a var_dict written in either the compact or the pickle format.'''
+    with open(path, 'rb') as f:
+        is_compact = f.read(len(MAGIC)) == MAGIC
+    if is_compact:
+        return CompactVarDict(path)
+    with open(path, 'rb') as f:
+        return pickle.load(f)
@@ -0,0 +1,200 @@
+'''
+Consistency check of check_data against the pandas implementation it replaced.
+Generates randomized plates in memory (Robo0 and Robo3 names, with
+missing and duplicated tiles and optionally zero-padded timepoints),
+runs the reference and the current check_data on each and compares the
+outcome, the error message and the _missing-images.csv /
+_extra-images.csv files they write. Exits non-zero if any plate differs.
+
+Example:
+    python verify_check_data.py --plates 200
+'''
+
+import os, sys, argparse, random, shutil, tempfile
+
+import file_index
+import token_schemes
+import Create_Folders_And_Check_Data as create_folders
+
+WELLS = ['A1', 'A2', 'B1', 'B10', 'C3']
+CHANNELS = ['FITC', 'RFP']
+
+
+def reference_parse_tokens(filenames, robo_num):
+    '''Data frame of the filenames with tokens in separate columns, as parsed before the file index.'''
+    import pandas as pd
+    files = pd.DataFrame(filenames, columns = ['Filename'])
+    if robo_num == 0:
+        files[['PID','ExptName','Timepoint','Hours','Well','Panel','Channel','BurstInterval',
+                   'Zstep','Zstep_size']] = files['Filename'].str.split('_', expand = True)
+        files[['Hours','BurstIndex']] = files['Hours'].str.split('-', expand = True)
+        files['Zstep_size'] = files['Zstep_size'].str.replace('.tif', '')
+        files['Timepoint'] = files['Timepoint'].str.replace('T', '')
+        files[['Timepoint','Panel','BurstIndex','Zstep']] = files[['Timepoint','Panel','BurstIndex','Zstep']].astype(int)
+    elif robo_num == 3:
+        files[['PID','ExptName','Timepoint','Hours','Well','Panel','Channel']] = files['Filename'].str.split('_', expand = True)
+        files['Timepoint'] = files['Timepoint'].str.replace('T', '')
+        files[['Timepoint','Panel']] = files[['Timepoint','Panel']].astype(int)
+    return files
+
+def reference_tiles_table(data, timepoints, num_panels, suffix, tiles_to_text):
+    '''
+    Per-timepoint groupby/merge of the reference check: one row per Well/Channel and one
+    column per timepoint, listing every panel where a well/channel has no file at the timepoint.
+    '''
+    import pandas as pd
+    output = data[['Well', 'Channel']].drop_duplicates()
+    all_panels = ','.join([str(i) for i in range(1, num_panels + 1)])
+    for tp in timepoints:
+        column = 'T' + str(tp) + suffix
+        data_tp = data.loc[data['Timepoint'] == tp].groupby(['Well', 'Channel'])['Panel'] \
+            .apply(list).reset_index(name = column)
+        data_tp[column] = data_tp[column].apply(tiles_to_text)
+        if len(data_tp) != 0:
+            output = pd.merge(output, data_tp, on = ['Well', 'Channel'], how = 'left')
+            output[column] = output[column].astype(object).where(output[column].notna(), all_panels)
+        else:
+            output[column] = all_panels
+    return output
+
+def reference_check_data(var_dict):
+    '''The groupby/merge check_data that the occupancy tensor replaced.'''
+    files_df = reference_parse_tokens([os.path.basename(x) for x in var_dict['AnalyzedFiles']], var_dict['RoboNumber'])
+    timepoints = sorted(set([int(x.replace('T','')) for x in var_dict['TimePoints']]))
+    files_df = files_df[files_df['Well'].isin(var_dict['Wells']) & files_df['Timepoint'].isin(timepoints)]
+    files_df['Channel'] = files_df['Channel'].str.replace('.tif', '')
+
+    incomplete_wells = []
+    extra_wells = []
+    num_panels = var_dict['NumberHorizontalImages'] * var_dict['NumberVerticalImages']
+    panel_counts = files_df.groupby(['Well','Timepoint','Channel']).size().reset_index(name='NumberOfPanels')
+    incomplete_wells.extend(panel_counts.loc[panel_counts['NumberOfPanels'] < num_panels, 'Well'].tolist())
+    extra_wells.extend(panel_counts.loc[panel_counts['NumberOfPanels'] > num_panels, 'Well'].tolist())
+
+    num_timepoints = len(var_dict['TimePoints'])
+    timepoint_counts = files_df.drop_duplicates(subset=['Well','Channel','Timepoint']) \
+        .groupby(['Well','Channel']).size().reset_index(name='NumberOfTimepoints')
+    incomplete_wells.extend(timepoint_counts.loc[timepoint_counts['NumberOfTimepoints'] < num_timepoints, 'Well'].tolist())
+    extra_wells.extend(timepoint_counts.loc[timepoint_counts['NumberOfTimepoints'] > num_timepoints, 'Well'].tolist())
+
+    num_channels = len(var_dict['Channels'])
+    channel_counts = files_df.groupby(['Well','Timepoint','Panel']).size().reset_index(name='NumberOfChannels')
+    incomplete_wells.extend(channel_counts.loc[channel_counts['NumberOfChannels'] < num_channels, 'Well'].tolist())
+    extra_wells.extend(channel_counts.loc[channel_counts['NumberOfChannels'] > num_channels, 'Well'].tolist())
+
+    if len(incomplete_wells) != 0:
+        output = reference_tiles_table(files_df[files_df['Well'].isin(set(incomplete_wells))], timepoints, num_panels,
+            '_missing-tiles', lambda x: ','.join([str(i) for i in range(1, num_panels + 1) if i not in x]))
+        output.to_csv(os.path.join(var_dict['GalaxyOutputPath'], var_dict['ExperimentName'] + '_missing-images.csv'), index = False)
+        raise ValueError('Dataset is missing images (also saved as csv in output directory):\n\n%s' % output.to_string(index = False, index_names = False))
+
+    if len(extra_wells) != 0:
+        def count_duplicates(lst):
+            return dict((x, lst.count(x)) for x in lst if lst.count(x) > 1)
+        output = reference_tiles_table(files_df[files_df['Well'].isin(set(extra_wells))], timepoints, num_panels,
+            '_extra-tiles', count_duplicates)
+        output.to_csv(os.path.join(var_dict['GalaxyOutputPath'], var_dict['ExperimentName'] + '_extra-images.csv'), index = False)
+        raise ValueError('Dataset has extra tiles (also saved as csv in output directory):\n\n%s' % output.to_string(index = False, index_names = False))
+
+def make_plate(rng, robo_num, num_timepoints, num_panels, missing, duplicated, padded):
+    '''Shuffled paths of one randomized plate.'''
+    paths = []
+    for tp in range(num_timepoints):
+        timepoint = ('T%02d' if padded else 'T%d') % tp
+        for well in WELLS:
+            for channel in CHANNELS:
+                for panel in range(1, num_panels + 1):
+                    r = rng.random()
+                    if r < missing:
+                        continue
+                    for copy in range(2 if r > 1 - duplicated else 1):
+                        if robo_num == 3:
+                            tokens = ['PID1', 'Exp', timepoint, str(tp * 24 + copy), well, str(panel), channel]
+                        else:
+                            tokens = ['PID1', 'Exp', timepoint, '%d-%d' % (tp * 24, copy), well, str(panel), channel, '0', '0', '1']
+                        paths.append('/raw/%s/%s.tif' % (well, '_'.join(tokens)))
+    rng.shuffle(paths)
+    return paths
+
+def run_check(check, var_dict):
+    try:
+        check(var_dict)
+        return 'complete'
+    except ValueError as e:
+        return str(e)
+
+def read_reports(output_path):
+    reports = {}
+    for name in ['Exp_missing-images.csv', 'Exp_extra-images.csv']:
+        path = os.path.join(output_path, name)
+        if os.path.exists(path):
+            with open(path) as f:
+                reports[name] = f.read()
+    return reports
+
+def compare_plate(seed, args, work_dir):
+    '''Run both implementations on one plate; returns a description of the differences (empty if none).'''
+    rng = random.Random(seed)
+    robo_num = rng.choice([0, 3])
+    padded = args.padded or rng.random() < 0.5
+    paths = make_plate(rng, robo_num, rng.randint(1, args.timepoints), args.panels, args.missing, args.duplicated, padded)
+
+    index = file_index.FileIndex(paths)
+    index.set_layout(token_schemes.classify(index.basenames))
+    var_dict = {'AnalyzedFiles': paths, 'RoboNumber': robo_num, 'ExperimentName': 'Exp',
+        'Wells': file_index.get_wells(index), 'TimePoints': file_index.get_timepoints(index),
+        'Channels': file_index.get_channels(index), 'NumberHorizontalImages': 1, 'NumberVerticalImages': args.panels}
+    selected = index.select(Well=var_dict['Wells'], Timepoint=var_dict['TimePoints'], Channel=var_dict['Channels'])
+
+    results = []
+    for name, check in [('reference', reference_check_data),
+            ('current', lambda vd: create_folders.check_data(vd, index, selected))]:
+        output_path = os.path.join(work_dir, '%d_%s' % (seed, name))
+        os.makedirs(output_path)
+        results.append((run_check(check, dict(var_dict, GalaxyOutputPath=output_path)), read_reports(output_path)))
+
+    (reference, reference_reports), (current, current_reports) = results
+    differences = []
+    if reference != current:
+        differences.append('outcome:\n%s\n-- current --\n%s' % (reference, current))
+    if reference_reports != current_reports:
+        differences.append('reports:\n%s\n-- current --\n%s' % (reference_reports, current_reports))
+    return '\n'.join(differences)
+
+def main():
+    '''Point of entry.'''
+
+    parser = argparse.ArgumentParser(description="Compare check_data with the reference implementation on randomized plates.")
+    parser.add_argument("--plates", type=int, default=200,
+        help="Number of randomized plates.")
+    parser.add_argument("--timepoints", type=int, default=4,
+        help="Maximum number of timepoints per plate.")
+    parser.add_argument("--panels", type=int, default=4,
+        help="Number of panels per montage.")
+    parser.add_argument("--missing", type=float, default=0.03,
+        help="Probability of leaving a tile out.")
+    parser.add_argument("--duplicated", type=float, default=0.03,
+        help="Probability of acquiring a tile twice.")
+    parser.add_argument("--padded", action="store_true",
+        help="Zero-pad every timepoint token (T01); otherwise half the plates are padded.")
+    parser.add_argument("--seed", type=int, default=0,
+        help="Seed of the first plate.")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='verify_check_data_')
+    num_different = 0
+    try:
+        for seed in range(args.seed, args.seed + args.plates):
+            differences = compare_plate(seed, args, work_dir)
+            if differences:
+                num_different += 1
+                print('Plate %d differs in %s' % (seed, differences))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    print('%d of %d plates match the reference check_data' % (args.plates - num_different, args.plates))
+    if num_different:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
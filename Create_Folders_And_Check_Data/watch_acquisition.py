@@ -0,0 +1,205 @@
+'''
+Watch mode for Create_Folders_And_Check_Data.
+Polls the raw image folder while the robot is still acquiring and feeds
+new files into a running completeness state. As soon as a timepoint's
+acquisition log (*-T<n>.log) appears, a completeness report for that
+timepoint is written, so a missing panel is flagged minutes after
+acquisition instead of when the pipeline fails. The log is written while
+the timepoint is still being acquired, so the report is written again
+whenever more files of an already reported timepoint arrive.
+
+Only folders whose mtime changed are listed again on each poll, and each
+new file costs O(1) to account for. Where the inotify_simple package is
+installed (local filesystems), inotify events wake the poll up early;
+on NFS the poll interval is used as is.
+'''
+
+import os, argparse, csv, time
+
+import crawler
+import completeness
+import token_schemes
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+
+class AcquisitionWatcher(object):
+    '''Incremental crawl of an input folder feeding an IncrementalCompleteness state.'''
+
+    def __init__(self, input_path, output_path, robo_num,
+            num_panels=None, settle_seconds=0, workers=crawler.DEFAULT_WORKERS):
+        self.input_path = input_path
+        self.output_path = output_path
+        self.schemes = token_schemes.get_schemes(robo_num)
+        self.num_panels = num_panels
+        self.settle_seconds = settle_seconds
+        self.workers = workers
+
+        self.state = completeness.IncrementalCompleteness()
+        self.scheme = None
+        self.layouts = {}
+        self.skipped = {}
+        self.experiment = None
+        self.cached_dirs = {}
+        self.seen_files = {}
+        self.pending_timepoints = {}
+        self.reported_timepoints = set()
+
+    def add_file(self, basename):
+        '''
+        Classify and tokenize one new file and count it; returns its timepoint.
+        Files of another naming scheme are skipped (returns None).
+        '''
+        code = token_schemes.classify([basename], self.schemes)[0]
+        name = token_schemes.scheme_names(code)
+        if self.scheme is None and code >= 0 and token_schemes.SCHEMES[code][1] is not None:
+            self.scheme = name
+            print('Token standard: Robo', token_schemes.SCHEMES[code][1], '(%s)' % name)
+        if code < 0 or name != self.scheme:
+            if name not in self.skipped:
+                print('Skipping files of the %s naming scheme, e.g. %s' % (name, basename))
+            self.skipped[name] = self.skipped.get(name, 0) + 1
+            return None
+        layout = self.layouts.get(code)
+        if layout is None:
+            layout = self.layouts[code] = token_schemes.get_layout(token_schemes.SCHEMES[code])
+        tokens = os.path.splitext(basename)[0].split('_')
+        self.experiment = self.experiment or tokens[layout['ExptName']]
+        self.state.add(tokens[layout['Well']], tokens[layout['Timepoint']],
+            tokens[layout['Channel']], int(tokens[layout['Panel']]))
+        return tokens[layout['Timepoint']]
+
+    def poll(self):
+        '''
+        List changed folders, count new files and report timepoints whose log has appeared.
+        A reported timepoint is reported again once new files of it have settled.
+        '''
+        dirs, num_relisted = crawler.crawl_sub_dir(self.input_path, None, self.workers, self.cached_dirs)
+        num_new = 0
+        updated_timepoints = set()
+        for dir_path, listing in dirs.items():
+            if self.cached_dirs.get(dir_path) is listing:
+                continue
+            seen = self.seen_files.setdefault(dir_path, set())
+            for name in listing[1]:
+                if name not in seen:
+                    seen.add(name)
+                    updated_timepoints.add(self.add_file(name))
+                    num_new += 1
+        root_changed = self.cached_dirs.get(self.input_path) is not dirs[self.input_path]
+        self.cached_dirs = dirs
+
+        now = time.time()
+        if root_changed:
+            for tp, log_path in crawler.get_timepoint_logs(self.input_path):
+                timepoint = 'T' + tp
+                if timepoint not in self.reported_timepoints and timepoint not in self.pending_timepoints:
+                    print('Found acquisition log for %s: %s' % (timepoint, log_path))
+                    self.pending_timepoints[timepoint] = now
+        # late files of a reported timepoint: report it again once they settle
+        for timepoint in updated_timepoints & self.reported_timepoints:
+            self.pending_timepoints[timepoint] = now
+        for timepoint, found_time in sorted(self.pending_timepoints.items()):
+            if now - found_time >= self.settle_seconds:
+                self.report(timepoint)
+                del self.pending_timepoints[timepoint]
+                self.reported_timepoints.add(timepoint)
+        return num_new
+
+    def report(self, timepoint):
+        '''Write <ExperimentName>_<timepoint>_completeness.csv for one timepoint.'''
+        num_panels = self.num_panels or self.state.max_panel
+        rows = self.state.timepoint_report(timepoint, num_panels)
+        # before any image is seen the experiment name is not known; use the input folder name
+        experiment = self.experiment or os.path.basename(os.path.normpath(self.input_path))
+        report_path = os.path.join(self.output_path, '%s_%s_completeness.csv' % (experiment, timepoint))
+        with open(report_path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['Well', 'Channel', timepoint + '_missing-tiles', timepoint + '_extra-tiles'])
+            writer.writerows(rows)
+        if timepoint in self.reported_timepoints:
+            print('New files for %s, updated report.' % timepoint)
+        if rows:
+            print('%s is incomplete for %d well/channel(s), see %s' % (timepoint, len(rows), report_path))
+        else:
+            print('%s is complete (%d wells, %d channels, %d panels).' % (
+                timepoint, len(self.state.wells), len(self.state.channels), num_panels))
+
+    def watch(self, poll_seconds, max_idle_minutes=0):
+        '''Poll until interrupted, or until nothing new arrived for max_idle_minutes.'''
+        notifier = None
+        watched = set()
+        if inotify_simple is not None:
+            notifier = inotify_simple.INotify()
+            watch_flags = inotify_simple.flags.CREATE | inotify_simple.flags.MOVED_TO | inotify_simple.flags.CLOSE_WRITE
+        last_new = time.time()
+        try:
+            while True:
+                if self.poll() > 0:
+                    last_new = time.time()
+                if max_idle_minutes and time.time() - last_new > max_idle_minutes * 60:
+                    print('No new files for %s minutes, stopping.' % max_idle_minutes)
+                    break
+                if notifier is None:
+                    time.sleep(poll_seconds)
+                    continue
+                for dir_path in self.cached_dirs:
+                    if dir_path not in watched:
+                        notifier.add_watch(dir_path, watch_flags)
+                        watched.add(dir_path)
+                notifier.read(timeout=int(poll_seconds * 1000))
+        except KeyboardInterrupt:
+            print('Watch interrupted.')
+        finally:
+            if notifier is not None:
+                notifier.close()
+
+
+def main():
+    '''Point of entry.'''
+
+    parser = argparse.ArgumentParser(description="Check data completeness while images are acquired.")
+    parser.add_argument("input_path",
+        help="Folder path to input data.")
+    parser.add_argument("output_path",
+        help="Folder path for per-timepoint completeness reports.")
+    parser.add_argument("--robo_num",
+        dest="robo_num", type=int, default=1,
+        help="Robo number (1 to auto-detect).")
+    parser.add_argument("--num_cols", dest="num_cols", type=int,
+        help="Number of horizontal images in montage.")
+    parser.add_argument("--num_rows", dest="num_rows", type=int,
+        help="Number of vertical images in montage.")
+    parser.add_argument("--poll_seconds",
+        dest="poll_seconds", type=float, default=30,
+        help="Seconds between polls of the input folder.")
+    parser.add_argument("--settle_seconds",
+        dest="settle_seconds", type=float, default=0,
+        help="Seconds to wait after a timepoint log appears before reporting it.")
+    parser.add_argument("--max_idle_minutes",
+        dest="max_idle_minutes", type=float, default=0,
+        help="Stop after this many minutes without new files (0 to run until interrupted).")
+    parser.add_argument("--crawl_workers",
+        dest="crawl_workers", type=int, default=crawler.DEFAULT_WORKERS,
+        help="Number of folders listed concurrently.")
+    args = parser.parse_args()
+
+    input_path = str.strip(args.input_path)
+    output_path = str.strip(args.output_path)
+    assert os.path.exists(input_path), 'Confirm that the input folder (%s) exists.' % input_path
+    os.makedirs(output_path, exist_ok=True)
+
+    num_panels = None
+    if args.num_cols is not None and args.num_rows is not None:
+        num_panels = args.num_cols * args.num_rows
+
+    watcher = AcquisitionWatcher(input_path, output_path, args.robo_num,
+        num_panels=num_panels, settle_seconds=args.settle_seconds, workers=args.crawl_workers)
+    watcher.watch(args.poll_seconds, args.max_idle_minutes)
+
+
+if __name__ == "__main__":
+    main()
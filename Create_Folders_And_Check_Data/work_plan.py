@@ -0,0 +1,94 @@
+'''
+Work-plan sharding of the selected files.
+Splits AnalyzedFiles into shards of whole wells, or of well x timepoint
+units, packed in plate order up to a target number of files or bytes.
+Each shard carries its file list and the per-well output folders of
+each downstream stage, so a stage can be fanned out as one job per shard.
+'''
+
+import os, json
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import file_index
+
+SHARD_BY = ['well', 'well_timepoint']
+OUTPUT_STAGES = ['BackgroundCorrected', 'MontagedImages', 'AlignedImages', 'CroppedImages',
+    'CellMasks', 'QualityControl', 'OverlaysTablesResults']
+DEFAULT_WORKERS = 32
+
+
+def file_sizes(paths, workers=DEFAULT_WORKERS):
+    '''Sizes of paths in bytes, stat-ed on a thread pool.'''
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        return np.array(list(executor.map(os.path.getsize, paths)), dtype=np.int64)
+
+def split_units(weights, target):
+    '''
+    Pack consecutive units into shards of about target weight.
+    A unit heavier than target gets a shard of its own; no target means one unit per shard.
+    Returns list of (first unit, last unit + 1).
+    '''
+    shards = []
+    start = 0
+    total = 0
+    for i, weight in enumerate(weights):
+        if i > start and (not target or total + weight > target):
+            shards.append((start, i))
+            start = i
+            total = 0
+        total += weight
+    if len(weights):
+        shards.append((start, len(weights)))
+    return shards
+
+def make_work_plan(var_dict, index, mask, shard_by='well', target_files=0, target_bytes=0, sizes=None):
+    '''
+    Build the work plan for the masked rows of the file index.
+    sizes (bytes per index row) is only needed with target_bytes.
+    '''
+    assert shard_by in SHARD_BY, 'Shards must be made by one of: %s' % ', '.join(SHARD_BY)
+    wells = list(var_dict['Wells'])
+    timepoints = list(var_dict['TimePoints'])
+
+    # order rows into contiguous units (well, or well x timepoint) in plate order
+    order, rows, row_wells, row_tps = file_index.well_timepoint_order(index, mask, wells, timepoints)
+    unit_keys = row_wells * len(timepoints) + row_tps if shard_by == 'well_timepoint' else row_wells
+    unit_starts = np.flatnonzero(np.r_[True, unit_keys[1:] != unit_keys[:-1]])
+    unit_ends = np.r_[unit_starts[1:], len(rows)]
+
+    if target_bytes:
+        assert sizes is not None, 'File sizes are needed to shard by bytes'
+        row_weights = np.asarray(sizes)[rows]
+        target = target_bytes
+    else:
+        row_weights = np.ones(len(rows), dtype=np.int64)
+        target = target_files
+    cumulative = np.r_[0, np.cumsum(row_weights)]
+    unit_weights = cumulative[unit_ends] - cumulative[unit_starts]
+
+    shards = []
+    for first, last in split_units(unit_weights, target):
+        start, end = unit_starts[first], unit_ends[last - 1]
+        shard_wells = [wells[w] for w in np.unique(row_wells[start:end])]
+        shards.append({
+            'Shard': len(shards),
+            'Wells': shard_wells,
+            'TimePoints': [timepoints[t] for t in np.unique(row_tps[start:end])],
+            'Units': [[wells[row_wells[i]]] + ([timepoints[row_tps[i]]] if shard_by == 'well_timepoint' else [])
+                for i in unit_starts[first:last]],
+            'NumberFiles': int(end - start),
+            'Bytes': int(cumulative[end] - cumulative[start]) if target_bytes else None,
+            'Files': [index.path(row) for row in rows[start:end]],
+            'Outputs': dict((stage, [os.path.join(var_dict[stage], well) for well in shard_wells])
+                for stage in OUTPUT_STAGES if stage in var_dict),
+        })
+
+    return {'ExperimentName': var_dict['ExperimentName'], 'ShardBy': shard_by,
+        'TargetFiles': target_files, 'TargetBytes': target_bytes,
+        'NumberShards': len(shards), 'Shards': shards}
+
+def write_work_plan(work_plan, path):
+    with open(path, 'w') as f:
+        json.dump(work_plan, f, indent=1)